@@ -4,209 +4,566 @@ Artificial Bee Colony algorithm
 
 
 import argparse
-import time
+import os
+from functools import partial
 
 import numpy as np
 
-from utils import ListAction, FUNCTIONS, print_statistics
+from cache import cli_cache
+from checkpoint import checkpoint_path, load_checkpoint, save_checkpoint
+from compiled import BACKENDS, backend_functions, compiled_kernel, move_bees
+from evaluators import EVALUATORS
+from islands import TOPOLOGIES, island_algorithm
+from profiling import stage, with_profile, write_profiles
+from streaming import Snapshot, drain, start_stream, stream_run
+from surrogate import cli_surrogate
+from termination import cli_budget
+from utils import (
+    ListAction, CountedFunction, DTYPES, FUNCTIONS, evaluate_batch, is_incremental,
+    print_statistics, run_repetitions
+)
+
+
+def gen_pop(n_food_sources, lower_bounds, upper_bounds, rng=None, dtype=np.float64):
+    '''
+    Generate the initial employed bees and food sources,
+    with the given floating point type
+    '''
+    rng = np.random.default_rng(rng)
+    food_sources = rng.random((n_food_sources, lower_bounds.size), dtype=dtype)
+    food_sources *= upper_bounds - lower_bounds
+    food_sources += lower_bounds
+    return food_sources
 
 
-def gen_pop(n_food_sources, lower_bounds, upper_bounds):
+class Scratch:
     '''
-    Generate the initial employed bees and food sources
+    Buffers of the candidates of the employed/onlooker bees stages and
+    of their values, allocated once per run and reused by all its stages
     '''
-    food_sources = np.full((n_food_sources, lower_bounds.size), lower_bounds)
-    random_vars = np.random.random_sample(food_sources.shape)
-    food_sources += random_vars * (upper_bounds - lower_bounds)
-    return food_sources
+
+    def __init__(self, n_food_sources, n_vars, dtype=np.float64):
+        self.candidates = np.empty((n_food_sources, n_vars), dtype=dtype)
+        self.values = np.empty(n_food_sources)
 
 
 def fitness(food_source, function):
     '''
     ABC fitness function
     '''
-    value = function(food_source)
-    return 1 / (1 + value) if value >= 0 else 1 + abs(value)
+    return value_fitness(function(food_source))
 
 
-def new_food_source(food_sources, lower_bounds, upper_bounds, index):
+def value_fitness(values):
     '''
-    Employed/onlooker bees new food source discovery
+    ABC fitness of the given objective values
     '''
-    n_food_sources, n_vars = food_sources.shape
-    d = np.random.choice(np.arange(n_vars))
-    new_index = np.random.choice(
-        np.delete(np.arange(n_food_sources), index)
-    )
-    food_source = np.array(food_sources[index], copy=True)
-    food_source[d] += np.random.uniform(-1, 1) * (
-        food_source[d] - food_sources[new_index][d]
-    )
+    values = np.asarray(values, dtype=float)
+    return np.where(values >= 0, 1 / (1 + np.abs(values)), 1 + np.abs(values))
+
+
+def evaluate(food_sources, function):
+    '''
+    Compute the objective values of the given food sources
+    '''
+    return evaluate_batch(function, food_sources)
+
+
+def draw_moves(rng, n_food_sources, n_vars, bees):
+    '''
+    Draw in a single block the random numbers of the moves of the given bees:
+    their changed coordinates, their partner food sources (drawn among
+    the other n_food_sources - 1 ones) and their steps in [-1, 1]
+    '''
+    d = rng.integers(n_vars, size=bees.size)
+    partners = rng.integers(n_food_sources - 1, size=bees.size)
+    partners += partners >= bees
+    return d, partners, rng.uniform(-1, 1, size=bees.size)
+
+
+def move_coordinate(food_sources, lower_bounds, upper_bounds, index, d, partner, phi):
+    '''
+    Compute the new value of the coordinate d of a food source,
+    moved by phi with respect to its partner
+    '''
+    x_d = food_sources[index, d]
+    x_d += phi * (x_d - food_sources[partner, d])
 
     # Shift onto boundaries
-    if food_source[d] > upper_bounds[d]:
-        food_source[d] = upper_bounds[d]
-    elif food_source[d] < lower_bounds[d]:
-        food_source[d] = lower_bounds[d]
+    if x_d > upper_bounds[d]:
+        x_d = upper_bounds[d]
+    elif x_d < lower_bounds[d]:
+        x_d = lower_bounds[d]
 
-    return food_source
+    return x_d
 
 
-def is_fit_better(old_food_source, food_source, function):
+def evaluate_move(function, food_sources, d, x_d, states=None, out=None):
     '''
-    Check if the fitness of a food source is better than
-    that of another one
+    Compute the value of a food source with its coordinate d set to x_d
+    (or of a matrix of food sources, with one move per row).
+    If the states of an incremental function are given, the values are
+    updated from them in O(1) instead of re-evaluating the food sources.
+    Otherwise the moved food sources are built in out, if given
+    (which may be the food sources themselves), instead of a copy.
+    Return the values and the new states
     '''
-    return fitness(old_food_source, function) < fitness(food_source, function)
+    if states is not None:
+        return function.delta(food_sources, states, d, x_d)
+    if out is None:
+        candidates = np.array(food_sources, copy=True)
+    else:
+        candidates = out
+        if out is not food_sources:
+            np.copyto(candidates, food_sources)
+    if candidates.ndim == 1:
+        candidates[d] = x_d
+        return function(candidates), None
+    candidates[np.arange(len(candidates)), d] = x_d
+    return evaluate_batch(function, candidates), None
 
 
-def best_fit(old_food_source, food_source, function):
+def is_fit_better(old_fitness, new_fitness):
     '''
-    Return the best food source, based on fitnesses
+    Check if a fitness value is better than another one
     '''
-    return (
-        food_source if is_fit_better(old_food_source, food_source, function)
-        else old_food_source
-    )
+    return old_fitness < new_fitness
 
 
-def find_current_best(current_best, food_sources, function):
+def find_best(food_sources, values, fitnesses):
     '''
-    Return the best food source or the current best, based on fitnesses
+    Return a copy of the best food source and its value, based on fitnesses
     '''
-    return best_fit(find_best(food_sources, function), current_best, function)
+    best_idx = np.argmax(fitnesses)
+    return np.array(food_sources[best_idx], copy=True), values[best_idx]
 
 
-def find_best(food_sources, function):
+def find_current_best(current_best, current_value, food_sources, values, fitnesses):
     '''
-    Return the best food source, based on fitnesses
+    Return the best food source or the current best (along with
+    its value), based on fitnesses
     '''
-    best_idx = np.argmax(np.apply_along_axis(
-        lambda x: fitness(x, function), axis=1, arr=food_sources
-    ))
-    return food_sources[best_idx]
+    best_food_source, best_value = find_best(food_sources, values, fitnesses)
+    if is_fit_better(value_fitness(best_value), value_fitness(current_value)):
+        return current_best, current_value
+    return best_food_source, best_value
 
 
-def onlooker_probabilities(food_sources, function):
+def onlooker_probabilities(fitnesses):
     '''
     Compute the probabilities of onlooker bees of moving to
     a new food source
     '''
-    probabilities = np.apply_along_axis(
-        lambda x: fitness(x, function), axis=1, arr=food_sources
-    )
-    probabilities /= np.sum(probabilities)
-    return probabilities
+    return fitnesses / np.sum(fitnesses)
 
 
-def probability(p):
+def select_bees(rng, n_food_sources, probabilities=None):
     '''
-    Return True with probability p
+    Return the bees moving in a stage: all of them for the employed bees,
+    or each one with its probability for the onlooker bees
     '''
-    assert(0 <= p <= 1)
-    return p > np.random.random_sample()
+    if probabilities is None:
+        return np.arange(n_food_sources)
+    return np.flatnonzero(probabilities > rng.random(n_food_sources))
 
 
-def renew_food_sources(food_sources, trails, limit, lower_bounds, upper_bounds, function, *args):
+def renew_food_sources(food_sources, values, fitnesses, trails, limit,
+                       lower_bounds, upper_bounds, function, *args, states=None, budget=None,
+                       rng=None):
     '''
     Scout bees stage
+    (the budget is only used by scout bees stages running nested searches)
     '''
     n_food_sources, n_vars = food_sources.shape
     assert(n_food_sources == trails.size)
 
-    for i, trail in enumerate(trails):
-        if trail >= limit:
-            food_sources[i] = renew_food_source(food_sources[i], lower_bounds, upper_bounds)
-            trails[i] = 0
-    return food_sources
+    exhausted = np.flatnonzero(trails >= limit)
+    if exhausted.size == 0:
+        return food_sources, values, fitnesses
+    j, x_j = renew_coordinate(food_sources[exhausted], lower_bounds, upper_bounds, rng)
+    values[exhausted], new_states = evaluate_move(
+        function, food_sources[exhausted], j, x_j, None if states is None else states[exhausted]
+    )
+    food_sources[exhausted, j] = x_j
+    fitnesses[exhausted] = value_fitness(values[exhausted])
+    if states is not None:
+        states[exhausted] = new_states
+    trails[exhausted] = 0
+    return food_sources, values, fitnesses
 
 
-def renew_food_source(food_source, lower_bounds, upper_bounds):
+def renew_coordinate(food_source, lower_bounds, upper_bounds, rng=None):
     '''
-    Compute a new food source for the scout bees stage
+    Compute a new food source for the scout bees stage,
+    returning only the changed coordinate and its new value
+    (or one of them for each row of a matrix of food sources)
     '''
-    n_vars = food_source.size
-    j = np.random.choice(np.arange(n_vars))
-    food_source[j] = (
-        lower_bounds[j] + np.random.random_sample() *
+    rng = np.random.default_rng(rng)
+    n_vars = np.shape(food_source)[-1]
+    size = None if np.ndim(food_source) == 1 else len(food_source)
+    j = rng.integers(n_vars, size=size)
+    x_j = (
+        lower_bounds[j] + rng.random(size) *
         (upper_bounds[j] - lower_bounds[j])
     )
+    return j, x_j
+
+
+def renew_food_source(food_source, lower_bounds, upper_bounds, rng=None):
+    '''
+    Compute a new food source for the scout bees stage
+    (or renew each row of a matrix of food sources)
+    '''
+    j, x_j = renew_coordinate(food_source, lower_bounds, upper_bounds, rng)
+    if np.ndim(food_source) == 1:
+        food_source[j] = x_j
+    else:
+        food_source[np.arange(len(food_source)), j] = x_j
     return food_source
 
 
-def move_food_sources(food_sources, lower_bounds, upper_bounds,
-                      trails, function, probabilities=None):
+def screen_moves(surrogate, food_sources, values, lower_bounds, upper_bounds,
+                 trails, bees, d, partners, phi, scratch=None):
     '''
-    Compute the new food sources and trails values for
-    the employed and onlooker bees
+    Pre-screen the moves of the given bees with a surrogate (see surrogate.py),
+    built from the food sources at the start of the stage
+    (in the candidates buffer of the given scratch, if any).
+    The moves not worth a true evaluation count as failed trails.
+    Return the mask of the moves to carry out
     '''
-    n_food_sources, _ = food_sources.shape
-    for i in range(n_food_sources):
-        if (probabilities is None or
-                (probabilities is not None and probability(probabilities[i]))):
-            food_source = new_food_source(food_sources, lower_bounds, upper_bounds, i)
-            if is_fit_better(food_sources[i], food_source, function):
-                food_sources[i] = food_source
-                trails[i] = 0
-            else:
-                trails[i] += 1
-    return food_sources, trails
+    candidates = np.take(
+        food_sources, bees, axis=0,
+        out=None if scratch is None else scratch.candidates[:bees.size]
+    )
+    x_d = candidates[np.arange(bees.size), d]
+    x_d += phi * (x_d - food_sources[partners, d])
+    candidates[np.arange(bees.size), d] = np.clip(x_d, lower_bounds[d], upper_bounds[d])
+    screened = surrogate.screen(candidates, values[bees])
+    trails[bees[~screened]] += 1
+    return screened
 
 
-def abc_algorithm(n_food_sources, lower_bounds, upper_bounds, limit,
-                  abc_stop, abc_iterations, function, *args):
+def move_food_sources(food_sources, values, fitnesses, lower_bounds, upper_bounds,
+                      trails, function, probabilities=None, states=None, rng=None,
+                      surrogate=None, scratch=None):
     '''
-    Main ABC algorithm
+    Compute the new food sources, values and trails for
+    the employed and onlooker bees.
+    The random numbers of the whole stage are drawn in a single block,
+    and the bees then move one after the other.
+    Only the newly discovered food sources are evaluated
+    (incrementally, if the states of the food sources are given),
+    and only the most promising ones if a surrogate is given.
+    The candidates are built in the buffers of the given scratch
+    (see Scratch), allocated here if missing.
     '''
-    lower_bounds = np.array(lower_bounds)
-    upper_bounds = np.array(upper_bounds)
+    rng = np.random.default_rng(rng)
+    n_food_sources, n_vars = food_sources.shape
+    if scratch is None:
+        scratch = Scratch(n_food_sources, n_vars, food_sources.dtype)
+    bees = select_bees(rng, n_food_sources, probabilities)
+    d, partners, phi = draw_moves(rng, n_food_sources, n_vars, bees)
+    if surrogate is not None:
+        screened = screen_moves(
+            surrogate, food_sources, values, lower_bounds, upper_bounds,
+            trails, bees, d, partners, phi, scratch
+        )
+        bees, d, partners, phi = bees[screened], d[screened], partners[screened], phi[screened]
+    for k, (i, d_i, partner, phi_i) in enumerate(
+            zip(bees.tolist(), d.tolist(), partners.tolist(), phi.tolist())):
+        x_d = move_coordinate(food_sources, lower_bounds, upper_bounds, i, d_i, partner, phi_i)
+        candidate = scratch.candidates[k]
+        value, state = evaluate_move(
+            function, food_sources[i], d_i, x_d, None if states is None else states[i],
+            out=candidate
+        )
+        if surrogate is not None:
+            if states is not None:
+                candidate[:] = food_sources[i]
+                candidate[d_i] = x_d
+            scratch.values[k] = value
+        food_fitness = value_fitness(value)
+        if is_fit_better(fitnesses[i], food_fitness):
+            food_sources[i, d_i] = x_d
+            values[i] = value
+            fitnesses[i] = food_fitness
+            if states is not None:
+                states[i] = state
+            trails[i] = 0
+        else:
+            trails[i] += 1
+    if surrogate is not None:
+        surrogate.add(scratch.candidates[:bees.size], scratch.values[:bees.size])
+    return food_sources, values, fitnesses, trails
+
+
+def move_food_sources_compiled(food_sources, values, fitnesses, lower_bounds, upper_bounds,
+                               trails, function, probabilities=None, states=None, rng=None,
+                               surrogate=None, scratch=None):
+    '''
+    Compute the new food sources, values and trails for
+    the employed and onlooker bees, as move_food_sources does
+    (drawing the same random numbers), with all the moves of the stage
+    carried out by a compiled kernel (see compiled.move_bees).
+    The function is a CountedFunction of a compiled function
+    (see compiled.compiled_kernel)
+    '''
+    rng = np.random.default_rng(rng)
+    n_food_sources, n_vars = food_sources.shape
+    bees = select_bees(rng, n_food_sources, probabilities)
+    d, partners, phi = draw_moves(rng, n_food_sources, n_vars, bees)
+    move_bees(
+        compiled_kernel(function), food_sources, values, fitnesses, trails,
+        lower_bounds, upper_bounds, bees, d, partners, phi
+    )
+    function.count(bees.size)
+    return food_sources, values, fitnesses, trails
+
+
+def move_food_sources_synchronous(food_sources, values, fitnesses, lower_bounds, upper_bounds,
+                                  trails, function, probabilities=None, states=None, rng=None,
+                                  surrogate=None, scratch=None):
+    '''
+    Compute the new food sources, values and trails for
+    the employed and onlooker bees, moving the whole colony at once.
+    Every candidate is built from the food sources at the start of the stage
+    and all of them (or only the most promising ones, if a surrogate
+    is given) are evaluated in a single batch.
+    The candidates are built in the buffers of the given scratch
+    (see Scratch), allocated here if missing.
+    '''
+    rng = np.random.default_rng(rng)
+    n_food_sources, n_vars = food_sources.shape
+    if scratch is None:
+        scratch = Scratch(n_food_sources, n_vars, food_sources.dtype)
+    bees = select_bees(rng, n_food_sources, probabilities)
+    d, partners, phi = draw_moves(rng, n_food_sources, n_vars, bees)
+    if surrogate is not None:
+        screened = screen_moves(
+            surrogate, food_sources, values, lower_bounds, upper_bounds,
+            trails, bees, d, partners, phi, scratch
+        )
+        bees, d, partners, phi = bees[screened], d[screened], partners[screened], phi[screened]
+    if bees.size == 0:
+        return food_sources, values, fitnesses, trails
+
+    candidates = np.take(food_sources, bees, axis=0, out=scratch.candidates[:bees.size])
+    x_d = candidates[np.arange(bees.size), d]
+    x_d += phi * (x_d - food_sources[partners, d])
+
+    # Shift onto boundaries
+    np.clip(x_d, lower_bounds[d], upper_bounds[d], out=x_d)
+
+    new_values, new_states = evaluate_move(
+        function, candidates, d, x_d, None if states is None else states[bees], out=candidates
+    )
+    if surrogate is not None:
+        candidates[np.arange(bees.size), d] = x_d
+        surrogate.add(candidates, new_values)
+    new_fitnesses = value_fitness(new_values)
+    better = is_fit_better(fitnesses[bees], new_fitnesses)
+    moved = bees[better]
+    food_sources[moved, d[better]] = x_d[better]
+    values[moved] = new_values[better]
+    fitnesses[moved] = new_fitnesses[better]
+    if states is not None:
+        states[moved] = new_states[better]
+    trails[moved] = 0
+    trails[bees[~better]] += 1
+    return food_sources, values, fitnesses, trails
+
+
+def iter_abc(n_food_sources, lower_bounds, upper_bounds, limit,
+             abc_stop, abc_iterations, function, *args,
+             synchronous=False, resync=100, evaluator=None, cache=None,
+             checkpoint=None, checkpoint_every=100, resume=False,
+             callback=None, profile=None, budget=None, migrate=None, rng=None,
+             surrogate=None, scout=None, dtype=np.float64):
+    '''
+    Iterations of the main ABC algorithm, yielding a snapshot after each
+    iteration (see streaming.Snapshot); closing the generator stops the run.
+    The scout bees stage is scout (renew_food_sources by default), called with
+    the extra positional arguments; its state, if any (see sabeec.WarmScout),
+    is saved in the checkpoints. The optional components are described
+    in their own modules (checkpoint, profiling, termination, islands, surrogate).
+    Return the best food source, the number of iterations
+    and the number of objective function evaluations
+    '''
+    lower_bounds = np.array(lower_bounds, dtype=dtype)
+    upper_bounds = np.array(upper_bounds, dtype=dtype)
     assert(lower_bounds.size == upper_bounds.size)
     assert(lower_bounds.size > 0)
     assert(n_food_sources > 0)
     assert(limit > 0)
     assert(abc_iterations > 0)
+    assert(checkpoint_every > 0)
+    function = CountedFunction(function, evaluator, cache)
+    move = move_food_sources_synchronous if synchronous else move_food_sources
+    # Compiled kernels are only called directly, without evaluator, cache nor surrogate
+    if not synchronous and surrogate is None and compiled_kernel(function) is not None:
+        move = move_food_sources_compiled
+    owner = budget is not None and budget.start(function)
+    rng = np.random.default_rng(rng)
+    scout = renew_food_sources if scout is None else scout
 
     # Initialization
-    food_sources = gen_pop(n_food_sources, lower_bounds, upper_bounds)
-    trails = np.zeros(n_food_sources)
-    best_food_source = find_best(food_sources, function)
+    if resume and checkpoint is not None and os.path.exists(checkpoint):
+        colony = load_checkpoint(checkpoint, rng)
+        food_sources = colony['food_sources'].astype(dtype, copy=False)
+        assert(food_sources.shape == (n_food_sources, lower_bounds.size))
+        values = colony['values']
+        fitnesses = colony['fitnesses']
+        states = colony.get('states')
+        trails = colony['trails']
+        best_food_source = colony['best_food_source']
+        best_value = colony['best_value']
+        best_equal = colony['best_equal']
+        iterations = colony['iterations']
+        function.evaluations = colony['evaluations']
+        if surrogate is not None:
+            surrogate.restore(colony)
+        if hasattr(scout, 'restore'):
+            scout.restore(colony)
+        if owner:
+            budget.restore(colony)
+        if colony['done']:
+            if owner:
+                budget.finish()
+            return best_food_source, iterations, function.evaluations
+        start = iterations
+    else:
+        with stage(profile, 'initialization', function):
+            food_sources = gen_pop(n_food_sources, lower_bounds, upper_bounds, rng, dtype)
+            values = evaluate(food_sources, function)
+            fitnesses = value_fitness(values)
+            states = function.state(food_sources) if is_incremental(function) else None
+            if surrogate is not None:
+                surrogate.add(food_sources, values)
+        trails = np.zeros(n_food_sources)
+        best_food_source, best_value = find_best(food_sources, values, fitnesses)
+        best_equal = 0
+        iterations = 1
+        start = 0
+    scratch = Scratch(n_food_sources, lower_bounds.size, dtype)
 
     # Main iterations
-    best_equal = 0
-    iterations = 1
-    for it in range(abc_iterations):
-        iterations = it + 1
-
-        # Employed bees stage
-        food_sources, trails = move_food_sources(
-            food_sources, lower_bounds, upper_bounds, trails, function
-        )
-        prev_best = best_food_source
-        best_food_source = find_current_best(best_food_source, food_sources, function)
-        best_equal = best_equal + 1 / 3 if np.array_equal(prev_best, best_food_source) else 0
-
-        # Onlooker bees stage
-        probabilities = onlooker_probabilities(food_sources, function)
-        food_sources, trails = move_food_sources(
-            food_sources, lower_bounds, upper_bounds, trails, function, probabilities
-        )
-        prev_best = best_food_source
-        best_food_source = find_current_best(best_food_source, food_sources, function)
-        best_equal = best_equal + 1 / 3 if np.array_equal(prev_best, best_food_source) else 0
-
-        # Scout bees stage
-        food_sources = renew_food_sources(
-            food_sources, trails, limit, lower_bounds, upper_bounds, function, *args
-        )
-        prev_best = best_food_source
-        best_food_source = find_current_best(best_food_source, food_sources, function)
-        best_equal = best_equal + 1 / 3 if np.array_equal(prev_best, best_food_source) else 0
-
-        # Stop criteria
-        if best_equal >= abc_stop:
-            break
-
-    return best_food_source, iterations
+    try:
+        for it in range(start, abc_iterations):
+            iterations = it + 1
+
+            # Employed bees stage
+            with stage(profile, 'employed', function):
+                food_sources, values, fitnesses, trails = move(
+                    food_sources, values, fitnesses, lower_bounds, upper_bounds,
+                    trails, function, states=states, rng=rng, surrogate=surrogate,
+                    scratch=scratch
+                )
+                prev_best = best_food_source
+                best_food_source, best_value = find_current_best(
+                    best_food_source, best_value, food_sources, values, fitnesses
+                )
+                best_equal = (
+                    best_equal + 1 / 3 if np.array_equal(prev_best, best_food_source) else 0
+                )
+
+            # Onlooker bees stage
+            with stage(profile, 'onlooker', function):
+                probabilities = onlooker_probabilities(fitnesses)
+                food_sources, values, fitnesses, trails = move(
+                    food_sources, values, fitnesses, lower_bounds, upper_bounds,
+                    trails, function, probabilities, states=states, rng=rng,
+                    surrogate=surrogate, scratch=scratch
+                )
+                prev_best = best_food_source
+                best_food_source, best_value = find_current_best(
+                    best_food_source, best_value, food_sources, values, fitnesses
+                )
+                best_equal = (
+                    best_equal + 1 / 3 if np.array_equal(prev_best, best_food_source) else 0
+                )
+
+            # Scout bees stage
+            exhausted = int(np.count_nonzero(trails >= limit))
+            with stage(profile, 'scout', function):
+                food_sources, values, fitnesses = scout(
+                    food_sources, values, fitnesses, trails, limit,
+                    lower_bounds, upper_bounds, function, *args,
+                    states=states, budget=budget, rng=rng
+                )
+                prev_best = best_food_source
+                best_food_source, best_value = find_current_best(
+                    best_food_source, best_value, food_sources, values, fitnesses
+                )
+                best_equal = (
+                    best_equal + 1 / 3 if np.array_equal(prev_best, best_food_source) else 0
+                )
+
+            # Incremental states resynchronization, bounding their floating point drift
+            if states is not None and iterations % resync == 0:
+                with stage(profile, 'resync', function):
+                    values = evaluate(food_sources, function)
+                    fitnesses = value_fitness(values)
+                    states = function.state(food_sources)
+
+            # Migration between colonies
+            if migrate is not None:
+                migrated = migrate(iterations, food_sources, values)
+                if migrated.size > 0:
+                    fitnesses[migrated] = value_fitness(values[migrated])
+                    trails[migrated] = 0
+                    if states is not None:
+                        states[migrated] = function.state(food_sources[migrated])
+                    prev_best = best_food_source
+                    best_food_source, best_value = find_current_best(
+                        best_food_source, best_value, food_sources, values, fitnesses
+                    )
+                    if not np.array_equal(prev_best, best_food_source):
+                        best_equal = 0
+
+            # Stop criteria
+            done = best_equal >= abc_stop or iterations == abc_iterations
+            if budget is not None and (budget.stop if owner else budget.exhausted)(best_value):
+                done = True
+            if profile is not None or callback is not None:
+                statistics = dict(
+                    iteration=iterations, best_value=float(best_value),
+                    evaluations=function.evaluations, trails_mean=float(np.mean(trails)),
+                    trails_max=float(np.max(trails)), exhausted=exhausted
+                )
+                if profile is not None:
+                    profile.record(**statistics)
+                if callback is not None and callback(
+                        dict(statistics, best_food_source=best_food_source)):
+                    done = True
+            if checkpoint is not None and (done or iterations % checkpoint_every == 0):
+                with stage(profile, 'checkpoint'):
+                    save_checkpoint(
+                        checkpoint, rng, food_sources=food_sources, values=values,
+                        fitnesses=fitnesses, states=states, trails=trails,
+                        best_food_source=best_food_source, best_value=best_value,
+                        best_equal=best_equal, iterations=iterations,
+                        evaluations=function.evaluations, done=done,
+                        **({} if surrogate is None else surrogate.state()),
+                        **(scout.state() if hasattr(scout, 'state') else {}),
+                        **(budget.state() if owner else {})
+                    )
+            yield Snapshot(iterations, best_food_source, float(best_value), function.evaluations)
+            if done:
+                break
+    finally:
+        if owner:
+            budget.finish()
+    return best_food_source, iterations, function.evaluations
+
+
+def abc_algorithm(*args, **kwargs):
+    '''
+    Main ABC algorithm, running all the iterations of iter_abc
+    with the given arguments.
+    Return the best food source, the number of iterations
+    and the number of objective function evaluations
+    '''
+    return drain(iter_abc(*args, **kwargs))
 
 
 def abc_cli_parser():
@@ -242,41 +599,192 @@ def abc_cli_parser():
         '-f', '--function', action='store', default='rosenbrock',
         type=str, choices=FUNCTIONS.keys(), help='benchmark function'
     )
+    parser.add_argument(
+        '--backend', action='store', default='numpy',
+        type=str, choices=BACKENDS, help='implementation of the benchmark function and kernels'
+    )
+    parser.add_argument(
+        '--dtype', action='store', default='float64',
+        type=str, choices=DTYPES.keys(), help='floating point type of the food sources'
+    )
     parser.add_argument(
         '-r', '--runtimes', action='store', default=1,
         type=int, help='number of executions'
     )
+    parser.add_argument(
+        '-s', '--synchronous', action='store_true',
+        help='move the whole colony at once in the employed/onlooker bees stages'
+    )
+    parser.add_argument(
+        '-e', '--evaluator', action='store', default='serial',
+        type=str, choices=EVALUATORS.keys(), help='objective function evaluator'
+    )
+    parser.add_argument(
+        '--evaluator_workers', action='store', default=None,
+        type=int, help='number of workers of the objective function evaluator'
+    )
+    parser.add_argument(
+        '--cache_size', action='store', default=None,
+        type=int, help='size of the in-memory objective function evaluations cache'
+    )
+    parser.add_argument(
+        '--cache_file', action='store', default=None,
+        type=str, help='SQLite file persisting the objective function evaluations cache'
+    )
+    parser.add_argument(
+        '--checkpoint', action='store', default=None,
+        type=str, help='file where the colony state is periodically saved'
+    )
+    parser.add_argument(
+        '--checkpoint_every', action='store', default=100,
+        type=int, help='number of iterations between checkpoints'
+    )
+    parser.add_argument(
+        '--resume', action='store_true',
+        help='resume the executions from their checkpoints, if any'
+    )
+    parser.add_argument(
+        '--islands', action='store', default=1,
+        type=int, help='number of colonies, each running in its own process'
+    )
+    parser.add_argument(
+        '--migration_every', action='store', default=10,
+        type=int, help='number of iterations between migrations of the best food sources'
+    )
+    parser.add_argument(
+        '--topology', action='store', default='ring',
+        type=str, choices=TOPOLOGIES, help='migration topology of the colonies'
+    )
+    parser.add_argument(
+        '--surrogate', action='store', default=None,
+        type=float, help='fraction of the bees candidates evaluated, as ranked by a surrogate'
+    )
+    parser.add_argument(
+        '--surrogate_archive', action='store', default=200,
+        type=int, help='number of recent evaluations the surrogate is fitted on'
+    )
+    parser.add_argument(
+        '--max_time', action='store', default=None,
+        type=float, help='maximum wall-clock seconds of each execution'
+    )
+    parser.add_argument(
+        '--max_evaluations', action='store', default=None,
+        type=int, help='maximum number of objective function evaluations of each execution'
+    )
+    parser.add_argument(
+        '--target', action='store', default=None,
+        type=float, help='objective value stopping the executions once reached'
+    )
+    parser.add_argument(
+        '--stall_iterations', action='store', default=None,
+        type=int, help='number of iterations without relative improvement before stopping'
+    )
+    parser.add_argument(
+        '--stall_tol', action='store', default=1e-8,
+        type=float, help='relative improvement of the best value counting as a stall'
+    )
+    parser.add_argument(
+        '--profile', action='store', default=None, nargs='?', const='-',
+        type=str, help='print the per-stage profile, or export it as JSON to the given file'
+    )
+    parser.add_argument(
+        '--stream', action='store', default=None, nargs='?', const='-',
+        type=str, help='write a JSON line per iteration to stdout, or to the given file'
+    )
+    parser.add_argument(
+        '-w', '--workers', action='store', default=1,
+        type=int, help='number of worker processes for the executions'
+    )
+    parser.add_argument(
+        '--seed', action='store', default=None,
+        type=int, help='seed of the random streams of the executions'
+    )
     return parser
 
 
 def main():
     parser = abc_cli_parser()
     args = parser.parse_args()
+    if args.islands > 1 and args.profile is not None:
+        parser.error('profiling is not supported with multiple islands')
+    if args.islands > 1 and args.stream is not None:
+        parser.error('streaming is not supported with multiple islands')
+    algorithm = abc_algorithm if args.stream is None else iter_abc
+    if args.islands > 1:
+        algorithm = partial(
+            island_algorithm, abc_algorithm, args.islands,
+            migration_every=args.migration_every, topology=args.topology
+        )
+    cache = cli_cache(args.cache_size, args.cache_file)
+    surrogates = [
+        cli_surrogate(args.surrogate, args.surrogate_archive) for _ in range(args.runtimes)
+    ]
+    with EVALUATORS[args.evaluator](args.evaluator_workers) as evaluator:
+        runs = [
+            partial(
+                algorithm,
+                args.n_food_sources, args.lower_bounds, args.upper_bounds,
+                args.limit, args.abc_stop, args.abc_iterations,
+                backend_functions(args.backend)[args.function],
+                synchronous=args.synchronous,
+                # Left out when serial, keeping the incremental bee moves
+                evaluator=None if args.evaluator == 'serial' else evaluator,
+                cache=cache,
+                checkpoint=checkpoint_path(args.checkpoint, run, args.runtimes),
+                checkpoint_every=args.checkpoint_every,
+                resume=args.resume,
+                budget=cli_budget(
+                    args.max_time, args.max_evaluations, args.target,
+                    args.stall_iterations, args.stall_tol
+                ),
+                surrogate=surrogate,
+                dtype=DTYPES[args.dtype]
+            )
+            for run, surrogate in enumerate(surrogates)
+        ]
+        if args.stream is not None:
+            start_stream(args.stream)
+            runs = [partial(stream_run, run, args.stream, i) for i, run in enumerate(runs)]
+        if args.profile is not None:
+            runs = [partial(with_profile, run) for run in runs]
+        runs = run_repetitions(runs, args.workers, args.seed)
+    if args.profile is not None:
+        profiles = [profile for (_, profile), _ in runs]
+        runs = [(result, run_time) for (result, _), run_time in runs]
     results = []
     mins = []
     iterations = []
+    evaluations = []
     times = []
-    for _ in range(args.runtimes):
-        start_time = time.time()
-        result, n_iteration = abc_algorithm(
-            args.n_food_sources, args.lower_bounds, args.upper_bounds,
-            args.limit, args.abc_stop, args.abc_iterations, FUNCTIONS[args.function]
-        )
-        times.append(time.time() - start_time)
+    for (result, n_iteration, n_evaluation), run_time in runs:
+        times.append(run_time)
         results.append(result)
         iterations.append(n_iteration)
+        evaluations.append(n_evaluation)
         mins.append(FUNCTIONS[args.function](result))
 
     # Print results
     if args.runtimes == 1:
         print(f'Result: {results[0]}')
         print(f'Minimum: {mins[0]}')
-        print(f'Iterations: {iterations[0]}/{args.nm_iterations}')
+        print(f'Iterations: {iterations[0]}/{args.abc_iterations}')
+        print(f'Evaluations: {evaluations[0]}')
         print(f'Execution time: {times[0]} seconds')
     else:
-        print_statistics(results, mins, iterations, args.abc_iterations, FUNCTIONS[args.function])
+        print_statistics(
+            results, mins, iterations, args.abc_iterations,
+            FUNCTIONS[args.function], evaluations
+        )
         print(f'Mean execution time: {np.mean(times)} seconds')
         print(f'Total execution time: {np.sum(times)} seconds')
+    if args.surrogate is not None and args.workers == 1 and args.islands == 1:
+        print(f'Surrogate saved evaluations: {sum(surrogate.saved for surrogate in surrogates)}')
+    if args.profile is not None:
+        write_profiles(profiles, args.profile)
+    if cache is not None:
+        if args.workers == 1:
+            print(f'Cache: {cache.stats()}')
+        cache.close()
 
 
 if __name__ == '__main__':
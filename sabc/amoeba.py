@@ -5,69 +5,292 @@ Nelder-Mead algorithm
 
 import argparse
 import time
+from functools import partial
+from typing import NamedTuple
 
 import numpy as np
 
-from utils import ListAction, FUNCTIONS
+from cache import cli_cache
+from compiled import BACKENDS, backend_functions
+from evaluators import EVALUATORS
+from profiling import Profile, stage, write_profiles
+from streaming import Snapshot, drain, start_stream, stream_run
+from surrogate import RBFSurrogate
+from termination import cli_budget
+from utils import ListAction, CountedFunction, DTYPES, FUNCTIONS, evaluate_batch
 
 
-def downhill_simplex(simplex, function, nm_iterations, tol, alpha, beta, gamma):
+class NelderMeadParams(NamedTuple):
     '''
-    Nelder-Mead algorithm
+    Parameters of the Nelder-Mead algorithm, in the order
+    of the positional arguments of downhill_simplex
+    '''
+    nm_iterations: int = 1000
+    tol: float = 1e-5
+    alpha: float = 1
+    beta: float = 0.5
+    gamma: float = 2
+
+
+def iter_downhill_simplex(simplex, function, nm_iterations, tol, alpha, beta, gamma,
+                          evaluator=None, cache=None, resync=100, callback=None,
+                          profile=None, budget=None, surrogate=None, dtype=np.float64,
+                          values=None, full_output=False):
+    '''
+    Iterations of the Nelder-Mead algorithm, yielding a snapshot after each
+    iteration (see streaming.Snapshot); closing the generator stops the run,
+    as does the callback, called with the statistics of each iteration,
+    returning True. The vertices are stored with the given floating point type,
+    and only the NaN ones of the given known values are evaluated.
+    The optional components are described in their own modules
+    (evaluators, cache, profiling, termination, surrogate).
+    Return the best vertex and the number of iterations (followed by
+    the final simplex and its values, sorted by value, if full_output is set)
     '''
     assert(alpha > 0)
     assert(0 < beta < 1)
     assert(gamma > 1)
     assert(tol > 0)
     assert(nm_iterations > 0)
+    assert(resync > 0)
+    function = CountedFunction(function, evaluator, cache)
+    owner = budget is not None and budget.start(function)
 
-    v = np.apply_along_axis(function, axis=1, arr=simplex)
+    # Values are kept sorted, order maps them to the vertices
+    with stage(profile, 'initialization', function):
+        simplex = np.array(simplex, dtype=dtype)
+        n = simplex.shape[1]
+        if values is None:
+            order, v = sort_simplex(evaluate_batch(function, simplex))
+        else:
+            known = np.array(values, dtype=float)
+            unknown = np.isnan(known)
+            if unknown.any():
+                known[unknown] = evaluate_batch(function, simplex[unknown])
+            order, v = sort_simplex(known)
+        vertex_sum = np.sum(simplex, axis=0)
+        if surrogate is not None:
+            surrogate.add(simplex[order], v)
     iterations = 1
     h = -1
     l = 0
+    try:
+        for it in range(nm_iterations):
+            iterations = it + 1
+            if stop_criteria(v, tol):
+                break
+            if budget is not None and (budget.stop if owner else budget.exhausted)(v[l]):
+                break
+            if profile is not None:
+                start_time = time.perf_counter()
+                start_evaluations = function.evaluations
+            # The running sum of the vertices is updated in place by every
+            # non-shrink operation, and recomputed to bound its drift
+            if it % resync == 0:
+                vertex_sum = np.sum(simplex, axis=0)
+
+            worst = order[h]
+            centroid = (vertex_sum - simplex[worst]) / n
+            x_prime = reflection(alpha, centroid, simplex[worst])
+            y_prime = function(x_prime)
+            if surrogate is not None:
+                surrogate.add(x_prime, y_prime)
+
+            operation = 'reflection'
+            if y_prime < v[l]:
+                x_second = expansion(gamma, centroid, x_prime)
+                y_second = np.inf
+                if surrogate is None or surrogate.improves(x_second, y_prime):
+                    y_second = function(x_second)
+                    if surrogate is not None:
+                        surrogate.add(x_second, y_second)
+                if y_second < v[l]:
+                    operation = 'expansion'
+                    replace_worst(simplex, order, v, vertex_sum, x_second, y_second)
+                else:
+                    replace_worst(simplex, order, v, vertex_sum, x_prime, y_prime)
+            elif y_prime > v[h - 1]:
+                if y_prime <= v[h]:
+                    replace_worst(simplex, order, v, vertex_sum, x_prime, y_prime)
+                x_second = contraction(beta, centroid, simplex[worst])
+                y_second = function(x_second)
+                if surrogate is not None:
+                    surrogate.add(x_second, y_second)
+                operation = 'contraction'
+                if y_second > v[h]:
+                    operation = 'shrink'
+                    # The best vertex is kept as it is by the shrink operation
+                    best = order[l]
+                    simplex = shrink(simplex, best)
+                    values = np.empty(n + 1)
+                    values[best] = v[l]
+                    others = order[l + 1:]
+                    values[others] = evaluate_batch(function, simplex[others])
+                    if surrogate is not None:
+                        surrogate.add(simplex[others], values[others])
+                    order, v = sort_simplex(values)
+                    vertex_sum = np.sum(simplex, axis=0)
+                else:
+                    replace_worst(simplex, order, v, vertex_sum, x_second, y_second)
+            else:
+                replace_worst(simplex, order, v, vertex_sum, x_prime, y_prime)
+
+            if profile is not None or callback is not None:
+                statistics = dict(
+                    iteration=iterations, best_value=float(v[l]), operation=operation,
+                    evaluations=function.evaluations, spread=float(np.std(v))
+                )
+                if profile is not None:
+                    profile.add(
+                        operation, time.perf_counter() - start_time,
+                        function.evaluations - start_evaluations
+                    )
+                    profile.record(**statistics)
+                if callback is not None and callback(
+                        dict(statistics, best_vertex=simplex[order[l]])):
+                    break
+            yield Snapshot(
+                iterations, simplex[order[l]].copy(), float(v[l]), function.evaluations
+            )
+    finally:
+        if owner:
+            budget.finish()
+    if full_output:
+        return simplex[order[l]], iterations, simplex[order], v
+    return simplex[order[l]], iterations
+
+
+def downhill_simplex(*args, **kwargs):
+    '''
+    Nelder-Mead algorithm, running all the iterations of iter_downhill_simplex
+    with the given arguments.
+    Return the best vertex and the number of iterations
+    '''
+    return drain(iter_downhill_simplex(*args, **kwargs))
+
+
+def sort_simplex(values):
+    '''
+    Return the order of the vertices of a simplex, based on their values,
+    and the sorted values
+    '''
+    order = np.argsort(values)
+    return order, values[order]
+
+
+def replace_worst(simplex, order, v, vertex_sum, point, value):
+    '''
+    Replace the worst vertex of the simplex with the given point, updating in place
+    the vertex sum and the sorted order and values with an ordered insertion
+    '''
+    worst = order[-1]
+    vertex_sum += point - simplex[worst]
+    simplex[worst] = point
+    position = np.searchsorted(v[:-1], value, side='right')
+    order[position + 1:] = order[position:-1]
+    v[position + 1:] = v[position:-1]
+    order[position] = worst
+    v[position] = value
+
+
+def downhill_simplices(simplices, function, nm_iterations, tol, alpha, beta, gamma,
+                       evaluator=None, cache=None, budget=None, dtype=np.float64,
+                       values=None, full_output=False):
+    '''
+    Nelder-Mead algorithm advancing a stack of simplices, with shape
+    (n_simplices, n + 1, n) and the given floating point type, in lock-step.
+    If given, values holds the known values of the initial vertices
+    (with shape (n_simplices, n + 1)), and only its NaN ones are evaluated.
+    The trial points of all the active simplices are evaluated in batches
+    (reflections first, then expansions/contractions, then shrinks)
+    and simplices are dropped as soon as they converge.
+    Batches are evaluated through the given evaluator and cache.
+    All the simplices stop as soon as the time, evaluations or target
+    criteria of the given budget are met (see downhill_simplex).
+    Return the best vertex and the number of iterations of each simplex
+    (followed by the final simplices and their vertex values, if full_output is set)
+    '''
+    assert(alpha > 0)
+    assert(0 < beta < 1)
+    assert(gamma > 1)
+    assert(tol > 0)
+    assert(nm_iterations > 0)
+    if evaluator is not None or cache is not None or budget is not None:
+        function = CountedFunction(function, evaluator, cache)
+    owner = budget is not None and budget.start(function)
+
+    simplices = np.array(simplices, dtype=dtype)
+    n_simplices, n_vertices, n_vars = simplices.shape
+    if values is None:
+        v = evaluate_batch(function, simplices.reshape(-1, n_vars)).reshape(
+            n_simplices, n_vertices
+        )
+    else:
+        v = np.array(values, dtype=float)
+        unknown = np.isnan(v)
+        if unknown.any():
+            v[unknown] = evaluate_batch(function, simplices[unknown])
+    iterations = np.ones(n_simplices, dtype=int)
+    active = np.arange(n_simplices)
+    h = -1
+    l = 0
     for it in range(nm_iterations):
-        iterations = it + 1
-        if stop_criteria(v, tol):
+        iterations[active] = it + 1
+        active = active[~stop_criteria(v[active], tol)]
+        if active.size == 0:
+            break
+        if budget is not None and budget.exhausted(np.min(v[active])):
             break
 
-        # Sort values and simplex
-        sorted_indexes = np.argsort(v)
-        v = v[sorted_indexes]
-        simplex = simplex[sorted_indexes]
-
-        centroid = np.mean(simplex[:h], axis=0)
-        x_prime = reflection(alpha, centroid, simplex[h])
-        y_prime = function(x_prime)
-        is_y_prime_best = (
-            (y_prime > v[:h]).sum() == v[:h].size
-        ).astype(np.int)
-
-        if y_prime < v[l]:
-            x_second = expansion(gamma, centroid, x_prime)
-            y_second = function(x_second)
-            if y_second < v[l]:
-                simplex[h] = x_second
-                v[h] = y_second
-            else:
-                simplex[h] = x_prime
-                v[h] = y_prime
-        elif is_y_prime_best:
-            if y_prime <= v[h]:
-                simplex[h] = x_prime
-                v[h] = y_prime
-            x_second = contraction(beta, centroid, simplex[h])
-            y_second = function(x_second)
-            if y_second > v[h]:
-                simplex = shrink(simplex, l)
-                v = np.apply_along_axis(function, axis=1, arr=simplex)
-            else:
-                simplex[h] = x_second
-                v[h] = y_second
-        else:
-            simplex[h] = x_prime
-            v[h] = y_prime
+        # Sort values and simplices
+        order = np.argsort(v[active], axis=1)
+        y = np.take_along_axis(v[active], order, axis=1)
+        simplex = np.take_along_axis(simplices[active], order[..., np.newaxis], axis=1)
 
-    return simplex[np.argmin(v)], iterations
+        centroid = np.mean(simplex[:, :h], axis=1)
+        x_prime = reflection(alpha, centroid, simplex[:, h])
+        y_prime = evaluate_batch(function, x_prime)
+        expand = y_prime < y[:, l]
+        contract = ~expand & np.all(y_prime[:, np.newaxis] > y[:, :h], axis=1)
+
+        # Contractions start from the reflected point if it is not worse
+        keep = contract & (y_prime <= y[:, h])
+        simplex[keep, h] = x_prime[keep]
+        y[keep, h] = y_prime[keep]
+
+        second = expand | contract
+        x_second = np.where(
+            expand[:, np.newaxis],
+            expansion(gamma, centroid, x_prime), contraction(beta, centroid, simplex[:, h])
+        )
+        y_second = np.full(active.size, np.inf)
+        y_second[second] = evaluate_batch(function, x_second[second])
+
+        expanded = expand & (y_second < y[:, l])
+        contracted = contract & (y_second <= y[:, h])
+        reflected = ~contract & ~expanded
+        shrunk = contract & ~contracted
+        simplex[expanded | contracted, h] = x_second[expanded | contracted]
+        y[expanded | contracted, h] = y_second[expanded | contracted]
+        simplex[reflected, h] = x_prime[reflected]
+        y[reflected, h] = y_prime[reflected]
+
+        # The best vertex is kept as it is by the shrink operation
+        if shrunk.any():
+            simplex[shrunk] = (simplex[shrunk] + simplex[shrunk, l:l + 1]) / 2
+            y[shrunk, 1:] = evaluate_batch(
+                function, simplex[shrunk, 1:].reshape(-1, n_vars)
+            ).reshape(-1, n_vertices - 1)
+
+        simplices[active] = simplex
+        v[active] = y
+
+    if owner:
+        budget.finish()
+    best = simplices[np.arange(n_simplices), np.argmin(v, axis=1)]
+    if full_output:
+        return best, iterations, simplices, v
+    return best, iterations
 
 
 def reflection(alpha, centroid, point):
@@ -93,42 +316,38 @@ def contraction(beta, centroid, point):
 
 def shrink(simplex, l):
     '''
-    Shrink geometric operation
+    Shrink geometric operation, in place
     '''
-    x_min = simplex[l]
-    return np.apply_along_axis(
-        lambda x: (x + x_min) / 2, axis=1, arr=simplex
-    )
+    x_min = simplex[l].copy()
+    simplex += x_min
+    simplex /= 2
+    return simplex
 
 
 def stop_criteria(v, tol):
     '''
     Check if the standard deviation of the values is within the given tolerance
+    (for a single simplex, or for each row of a stack of simplices values)
     '''
-    mu = np.mean(v)
-    n = len(v)
-    return np.sqrt(
-        np.sum(
-            np.apply_along_axis(lambda x: x ** 2, axis=0, arr=(v - mu))
-        ) / n
-    ) <= tol
+    return np.std(v, axis=-1) <= tol
 
 
-def simplex_coordinates(x_zero):
+def simplex_coordinates(x_zero, step=None):
     '''
     Generate a simplex starting from the given initial point.
     Implementation based upon Matlab's fminsearch routine.
+    If given, step holds the (possibly negative) step of each coordinate
+    instead of the fixed ones.
+    The simplex keeps the floating point type of the initial point
+    (float64 for integer points)
     '''
-    x = [x_zero]
+    x_zero = np.asarray(x_zero, dtype=np.result_type(x_zero, np.float32))
     n = x_zero.size
-    b = np.eye(n)
-    for i in range(n):
-        h = (
-            0.05 if x_zero[i] != 0
-            else 0.00025
-        )
-        x.append(x_zero + h * b[i])
-    return np.array(x)
+    x = np.repeat(x_zero[np.newaxis], n + 1, axis=0)
+    if step is None:
+        step = np.where(x_zero != 0, 0.05, 0.00025)
+    x[np.arange(1, n + 1), np.arange(n)] += step
+    return x
 
 
 def amoeba_cli_parser():
@@ -166,6 +385,66 @@ def amoeba_cli_parser():
         '-f', '--function', action='store', default='rosenbrock',
         type=str, choices=FUNCTIONS.keys(), help='benchmark function'
     )
+    parser.add_argument(
+        '--backend', action='store', default='numpy',
+        type=str, choices=BACKENDS, help='implementation of the benchmark function and kernels'
+    )
+    parser.add_argument(
+        '--dtype', action='store', default='float64',
+        type=str, choices=DTYPES.keys(), help='floating point type of the simplex'
+    )
+    parser.add_argument(
+        '-e', '--evaluator', action='store', default='serial',
+        type=str, choices=EVALUATORS.keys(), help='objective function evaluator'
+    )
+    parser.add_argument(
+        '--evaluator_workers', action='store', default=None,
+        type=int, help='number of workers of the objective function evaluator'
+    )
+    parser.add_argument(
+        '--cache_size', action='store', default=None,
+        type=int, help='size of the in-memory objective function evaluations cache'
+    )
+    parser.add_argument(
+        '--cache_file', action='store', default=None,
+        type=str, help='SQLite file persisting the objective function evaluations cache'
+    )
+    parser.add_argument(
+        '--max_time', action='store', default=None,
+        type=float, help='maximum wall-clock seconds of the execution'
+    )
+    parser.add_argument(
+        '--max_evaluations', action='store', default=None,
+        type=int, help='maximum number of objective function evaluations of the execution'
+    )
+    parser.add_argument(
+        '--target', action='store', default=None,
+        type=float, help='objective value stopping the execution once reached'
+    )
+    parser.add_argument(
+        '--stall_iterations', action='store', default=None,
+        type=int, help='number of iterations without relative improvement before stopping'
+    )
+    parser.add_argument(
+        '--stall_tol', action='store', default=1e-8,
+        type=float, help='relative improvement of the best value counting as a stall'
+    )
+    parser.add_argument(
+        '--surrogate', action='store_true',
+        help='skip the expansions predicted not to improve by a surrogate of the objective'
+    )
+    parser.add_argument(
+        '--surrogate_archive', action='store', default=200,
+        type=int, help='number of recent evaluations the surrogate is fitted on'
+    )
+    parser.add_argument(
+        '--profile', action='store', default=None, nargs='?', const='-',
+        type=str, help='print the per-stage profile, or export it as JSON to the given file'
+    )
+    parser.add_argument(
+        '--stream', action='store', default=None, nargs='?', const='-',
+        type=str, help='write a JSON line per iteration to stdout, or to the given file'
+    )
     return parser
 
 
@@ -175,15 +454,38 @@ def main():
     start_time = time.time()
     simplex = simplex_coordinates(np.array(args.initial_point))
     print(f'Initial simplex: {simplex}')
-    result, iterations = downhill_simplex(
-        simplex, FUNCTIONS[args.function], args.nm_iterations,
-        args.tol, args.alpha, args.beta, args.gamma
+    cache = cli_cache(args.cache_size, args.cache_file)
+    profile = None if args.profile is None else Profile()
+    surrogate = RBFSurrogate(archive_size=args.surrogate_archive) if args.surrogate else None
+    budget = cli_budget(
+        args.max_time, args.max_evaluations, args.target, args.stall_iterations, args.stall_tol
     )
+    with EVALUATORS[args.evaluator](args.evaluator_workers) as evaluator:
+        run = partial(
+            iter_downhill_simplex, simplex, backend_functions(args.backend)[args.function],
+            args.nm_iterations, args.tol, args.alpha, args.beta, args.gamma,
+            evaluator=evaluator, cache=cache, profile=profile, budget=budget,
+            surrogate=surrogate, dtype=DTYPES[args.dtype]
+        )
+        if args.stream is None:
+            result, iterations = drain(run())
+        else:
+            start_stream(args.stream)
+            result, iterations = stream_run(run, args.stream)
     end_time = time.time() - start_time
     print(f'Result: {result}')
     print(f'Minimum: {FUNCTIONS[args.function](result)}')
     print(f'Iterations: {iterations}/{args.nm_iterations}')
+    if budget is not None and budget.reason is not None:
+        print(f'Stop reason: {budget.reason}')
     print(f'Execution time: {end_time} seconds')
+    if surrogate is not None:
+        print(f'Surrogate: {surrogate.stats()}')
+    if profile is not None:
+        write_profiles([profile], args.profile)
+    if cache is not None:
+        print(f'Cache: {cache.stats()}')
+        cache.close()
 
 
 if __name__ == "__main__":
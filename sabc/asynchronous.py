@@ -0,0 +1,136 @@
+'''
+asyncio entry points of the algorithms for coroutine objective functions
+'''
+
+
+import asyncio
+import inspect
+
+import numpy as np
+
+from abeec import abc_algorithm
+from amoeba import downhill_simplex
+from cache import function_key
+from sabeec import sabc_algorithm
+
+
+class AsyncObjective:
+    '''
+    Batched synchronous facade of an objective function returning awaitables
+    (such as an async def function), for the algorithms running outside of
+    the event loop. Each batch of points is gathered on the given loop,
+    keeping up to concurrency evaluations in flight.
+    Evaluations lasting more than timeout seconds are cancelled and get
+    timeout_value (infinite by default, so that their points are discarded),
+    and are counted in timeouts.
+    Once cancelled, any further evaluation raises asyncio.CancelledError,
+    stopping the algorithm
+    '''
+
+    batched = True
+
+    def __init__(self, function, loop, concurrency=64, timeout=None, timeout_value=np.inf):
+        assert(concurrency > 0)
+        assert(timeout is None or timeout > 0)
+        self.function = function
+        self.cache_key = function_key(function)
+        self.loop = loop
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.timeout_value = timeout_value
+        self.semaphore = None
+        self.timeouts = 0
+        self.cancelled = False
+
+    async def evaluate_point(self, x):
+        async with self.semaphore:
+            value = self.function(x)
+            if inspect.isawaitable(value):
+                try:
+                    value = await asyncio.wait_for(value, self.timeout)
+                except asyncio.TimeoutError:
+                    self.timeouts += 1
+                    return self.timeout_value
+            return value
+
+    async def evaluate_points(self, points):
+        # The semaphore is created on the loop, on first use
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+        return np.array(
+            await asyncio.gather(*(self.evaluate_point(x) for x in points)), dtype=float
+        )
+
+    def __call__(self, x):
+        if self.cancelled:
+            raise asyncio.CancelledError()
+        values = asyncio.run_coroutine_threadsafe(
+            self.evaluate_points(np.atleast_2d(x)), self.loop
+        ).result()
+        return values if np.ndim(x) > 1 else values[0]
+
+
+async def run_async(run, function, concurrency=64, timeout=None):
+    '''
+    Execute run(objective), with the AsyncObjective of the given function
+    evaluated on the running loop, in a worker thread, so that the numerical
+    work of the algorithm does not block the loop while all the evaluations
+    are awaited on it. Cancelling the returned coroutine stops the run
+    at its next evaluation
+    '''
+    loop = asyncio.get_running_loop()
+    objective = AsyncObjective(function, loop, concurrency, timeout)
+    try:
+        return await loop.run_in_executor(None, run, objective)
+    except asyncio.CancelledError:
+        objective.cancelled = True
+        raise
+
+
+async def abc_algorithm_async(n_food_sources, lower_bounds, upper_bounds, limit,
+                              abc_stop, abc_iterations, function, *args,
+                              concurrency=64, timeout=None, synchronous=True, **kwargs):
+    '''
+    ABC algorithm (see abeec.abc_algorithm) for a coroutine objective function,
+    with up to concurrency evaluations in flight, each cancelled after
+    timeout seconds (see AsyncObjective).
+    The colony moves synchronously by default, so that all the candidates
+    of each employed/onlooker bees stage are evaluated concurrently
+    '''
+    return await run_async(
+        lambda objective: abc_algorithm(
+            n_food_sources, lower_bounds, upper_bounds, limit, abc_stop, abc_iterations,
+            objective, *args, synchronous=synchronous, **kwargs
+        ),
+        function, concurrency, timeout
+    )
+
+
+async def sabc_algorithm_async(n_food_sources, lower_bounds, upper_bounds, limit,
+                               abc_stop, abc_iterations, function, *nelder_mead,
+                               concurrency=64, timeout=None, synchronous=True, **kwargs):
+    '''
+    SABC algorithm (see sabeec.sabc_algorithm) for a coroutine objective
+    function (see abc_algorithm_async). The trial points of the Nelder-Mead
+    runs of each scout bees stage are evaluated concurrently as well
+    '''
+    return await run_async(
+        lambda objective: sabc_algorithm(
+            n_food_sources, lower_bounds, upper_bounds, limit, abc_stop, abc_iterations,
+            objective, *nelder_mead, synchronous=synchronous, **kwargs
+        ),
+        function, concurrency, timeout
+    )
+
+
+async def downhill_simplex_async(simplex, function, *args, concurrency=64, timeout=None,
+                                 **kwargs):
+    '''
+    Nelder-Mead algorithm (see amoeba.downhill_simplex) for a coroutine
+    objective function (see AsyncObjective). The vertices of the initial
+    and shrunken simplices are evaluated concurrently
+    '''
+    return await run_async(
+        lambda objective: downhill_simplex(simplex, objective, *args, **kwargs),
+        function, concurrency, timeout
+    )
@@ -0,0 +1,263 @@
+'''
+Batch runner solving many optimization problems from a job file
+'''
+
+
+import argparse
+import csv
+import json
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import nullcontext
+from functools import partial
+
+import numpy as np
+
+from abeec import abc_algorithm
+from amoeba import NelderMeadParams, downhill_simplex, simplex_coordinates
+from compiled import backend_functions
+from sabeec import sabc_algorithm
+from surrogate import cli_surrogate
+from termination import cli_budget
+from utils import CountedFunction, DTYPES, FUNCTIONS, parse_list, seeded_run
+
+
+JOB_ALGORITHMS = ('abc', 'sabc', 'nm')
+# Parameters of the jobs, with the defaults of the CLIs
+DEFAULTS = {
+    'n_food_sources': 100,
+    'limit': 20,
+    'abc_iterations': 3000,
+    'abc_stop': 100,
+    'nm_iterations': 1000,
+    'tol': 1e-5,
+    'alpha': 1,
+    'beta': 0.5,
+    'gamma': 2,
+    'synchronous': False,
+    'scout_workers': 0,
+    'warm_start': False,
+    'initial_point': None,
+    'surrogate': None,
+    'surrogate_archive': 200,
+    'max_time': None,
+    'max_evaluations': None,
+    'target': None,
+    'stall_iterations': None,
+    'stall_tol': 1e-8,
+    'backend': 'numpy',
+    'dtype': 'float64',
+    'seed': None
+}
+LIST_FIELDS = ('lower_bounds', 'upper_bounds', 'initial_point')
+
+
+def parse_cell(value):
+    '''
+    Parse a CSV cell as a boolean, an integer, a float or a string
+    '''
+    if value.lower() in ('true', 'false'):
+        return value.lower() == 'true'
+    for kind in (int, float):
+        try:
+            return kind(value)
+        except ValueError:
+            pass
+    return value
+
+
+def read_jobs(path):
+    '''
+    Read the jobs of a JSONL file (one JSON object per line) or of a CSV
+    file (one job per row, with a header naming the fields, empty cells
+    keeping the defaults). Bounds and initial points are lists or
+    comma-separated strings (see utils.parse_list).
+    Jobs without an id get their line index
+    '''
+    with open(path, newline='') as f:
+        if path.endswith('.csv'):
+            jobs = [
+                {key: parse_cell(value) for key, value in row.items() if value != ''}
+                for row in csv.DictReader(f)
+            ]
+        else:
+            jobs = [json.loads(line) for line in f if line.strip()]
+    for index, job in enumerate(jobs):
+        job.setdefault('id', index)
+        for field in LIST_FIELDS:
+            if isinstance(job.get(field), str):
+                job[field] = parse_list(job[field])
+    return jobs
+
+
+def job_parameters(job):
+    '''
+    Return the parameters of a job, completed with the defaults
+    '''
+    assert job['algorithm'] in JOB_ALGORITHMS, f"unknown algorithm: {job['algorithm']}"
+    assert job['function'] in FUNCTIONS, f"unknown function: {job['function']}"
+    unknown = set(job) - set(DEFAULTS) - {'id', 'algorithm', 'function', *LIST_FIELDS}
+    assert not unknown, f'unknown job parameters: {sorted(unknown)}'
+    return {**DEFAULTS, **job}
+
+
+def expected_cost(job):
+    '''
+    Estimate the cost of a job as its maximum number of objective
+    function evaluations (capped by its evaluations budget)
+    times its number of variables
+    '''
+    job = job_parameters(job)
+    if job['algorithm'] == 'nm':
+        evaluations = 2 * job['nm_iterations']
+    else:
+        evaluations = 2 * job['n_food_sources'] * job['abc_iterations']
+    if job['max_evaluations'] is not None:
+        evaluations = min(evaluations, job['max_evaluations'])
+    return evaluations * len(job['lower_bounds'])
+
+
+def valid(job):
+    '''
+    Check if the parameters of a job are valid (invalid jobs fail when run)
+    '''
+    try:
+        job_parameters(job)
+    except (AssertionError, KeyError):
+        return False
+    return 'lower_bounds' in job
+
+
+def solve_job(job, rng=None):
+    '''
+    Solve the problem of a job with the given random generator (or seed),
+    returning its best point, number of iterations and number of evaluations
+    '''
+    function = backend_functions(job['backend'])[job['function']]
+    dtype = DTYPES[job['dtype']]
+    lower_bounds = np.array(job['lower_bounds'], dtype=float)
+    upper_bounds = np.array(job['upper_bounds'], dtype=float)
+    nelder_mead = NelderMeadParams(
+        job['nm_iterations'], job['tol'], job['alpha'], job['beta'], job['gamma']
+    )
+    budget = cli_budget(
+        job['max_time'], job['max_evaluations'], job['target'],
+        job['stall_iterations'], job['stall_tol']
+    )
+    if job['algorithm'] == 'nm':
+        initial_point = job['initial_point']
+        if initial_point is None:
+            initial_point = lower_bounds + np.random.default_rng(rng).random(
+                lower_bounds.size
+            ) * (upper_bounds - lower_bounds)
+        function = CountedFunction(function)
+        result, iterations = downhill_simplex(
+            simplex_coordinates(np.array(initial_point, dtype=float)), function, *nelder_mead,
+            budget=budget, dtype=dtype
+        )
+        return result, iterations, function.evaluations
+    args = (
+        job['n_food_sources'], lower_bounds, upper_bounds, job['limit'],
+        job['abc_stop'], job['abc_iterations'], function
+    )
+    kwargs = dict(
+        synchronous=job['synchronous'], budget=budget, rng=rng, dtype=dtype,
+        surrogate=cli_surrogate(job['surrogate'], job['surrogate_archive'])
+    )
+    if job['algorithm'] == 'sabc':
+        return sabc_algorithm(
+            *args, nelder_mead, scout_workers=job['scout_workers'],
+            warm_start=job['warm_start'], **kwargs
+        )
+    return abc_algorithm(*args, **kwargs)
+
+
+def run_job(job, seed):
+    '''
+    Execute a job with its own seed (or the given seed sequence),
+    returning its result record (with the error of a failed job)
+    '''
+    record = {'id': job['id'], 'algorithm': job.get('algorithm'), 'function': job.get('function')}
+    try:
+        job = job_parameters(job)
+        seed = seed if job['seed'] is None else job['seed']
+        (result, iterations, evaluations), run_time = seeded_run(partial(solve_job, job), seed)
+    except Exception as error:
+        return dict(record, error=repr(error))
+    return dict(
+        record, result=result.tolist(), value=float(FUNCTIONS[job['function']](result)),
+        iterations=int(iterations), evaluations=int(evaluations), time=run_time
+    )
+
+
+def run_batch(jobs, output='-', workers=1, seed=None):
+    '''
+    Execute the jobs over a pool of worker processes, longest expected
+    jobs first (see expected_cost), writing the record of each job
+    as a JSON line to the given file or to stdout as soon as it finishes.
+    Jobs without a seed get independent random streams spawned from the given
+    seed in the order of the job file, so results do not depend on the schedule.
+    Return the number of failed jobs
+    '''
+    assert(workers > 0)
+    seeds = np.random.SeedSequence(seed).spawn(len(jobs))
+    order = sorted(
+        range(len(jobs)), key=lambda i: expected_cost(jobs[i]) if valid(jobs[i]) else 0,
+        reverse=True
+    )
+    failed = 0
+    with nullcontext(sys.stdout) if output == '-' else open(output, 'w') as f:
+        if workers == 1:
+            records = (run_job(jobs[i], seeds[i]) for i in order)
+        else:
+            executor = ProcessPoolExecutor(max_workers=workers)
+            futures = [executor.submit(run_job, jobs[i], seeds[i]) for i in order]
+            records = (future.result() for future in as_completed(futures))
+        try:
+            for record in records:
+                failed += 'error' in record
+                f.write(json.dumps(record) + '\n')
+                f.flush()
+        finally:
+            if workers > 1:
+                for future in futures:
+                    future.cancel()
+                executor.shutdown()
+    return failed
+
+
+def batch_cli_parser():
+    '''
+    Create a standard input arguments parser
+    '''
+    parser = argparse.ArgumentParser(
+        prog='batch', description='Batch runner of optimization jobs'
+    )
+    parser.add_argument(
+        dest='jobs', action='store',
+        type=str, help='JSONL or CSV file of jobs (algorithm, function, bounds and parameters)'
+    )
+    parser.add_argument(
+        '-o', '--output', action='store', default='-',
+        type=str, help='JSONL file where the job results are written as they finish'
+    )
+    parser.add_argument(
+        '-w', '--workers', action='store', default=1,
+        type=int, help='number of worker processes for the jobs'
+    )
+    parser.add_argument(
+        '--seed', action='store', default=None,
+        type=int, help='seed of the random streams of the jobs without their own seed'
+    )
+    return parser
+
+
+def main():
+    parser = batch_cli_parser()
+    args = parser.parse_args()
+    if run_batch(read_jobs(args.jobs), args.output, args.workers, args.seed):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
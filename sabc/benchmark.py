@@ -0,0 +1,358 @@
+'''
+Benchmark suite of the implemented algorithms
+'''
+
+
+import argparse
+import json
+import sys
+from functools import partial
+
+import numpy as np
+
+from abeec import abc_algorithm
+from amoeba import NelderMeadParams, downhill_simplex, simplex_coordinates
+from compiled import BACKENDS, backend_functions, warm_up
+from sabeec import sabc_algorithm
+from utils import CountedFunction, FUNCTIONS, seeded_run
+
+
+# Search domains and global minima of the benchmark functions
+DOMAINS = {
+    'ackley': (-32, 32),
+    'rastrigin': (-5.12, 5.12),
+    'rosenbrock': (-30, 30),
+    'schaffer': (-100, 100),
+    'sixhump': ([-3, -2], [3, 2])
+}
+MINIMA = {
+    'ackley': 0,
+    'rastrigin': 0,
+    'rosenbrock': 0,
+    'schaffer': 0,
+    'sixhump': -1.0316284534898774
+}
+# Functions only defined for a given number of variables
+DIMENSIONS = {
+    'sixhump': 2
+}
+
+
+def domain(function_name, n_vars):
+    '''
+    Return the lower and upper bounds of the given benchmark function
+    '''
+    lower_bounds, upper_bounds = DOMAINS[function_name]
+    return (
+        np.broadcast_to(np.asarray(lower_bounds, dtype=float), n_vars).copy(),
+        np.broadcast_to(np.asarray(upper_bounds, dtype=float), n_vars).copy()
+    )
+
+
+def run_abc(function, lower_bounds, upper_bounds, population, args, callback, rng=None):
+    '''
+    ABC benchmark run, returning its result and number of evaluations
+    '''
+    result, _, evaluations = abc_algorithm(
+        population, lower_bounds, upper_bounds, args.limit, args.abc_stop,
+        args.abc_iterations, function, callback=callback, rng=rng
+    )
+    return result, evaluations
+
+
+def run_nm(function, lower_bounds, upper_bounds, population, args, callback, rng=None):
+    '''
+    Nelder-Mead benchmark run from a random initial point,
+    returning its result and number of evaluations
+    '''
+    function = CountedFunction(function)
+    initial_point = lower_bounds + np.random.default_rng(rng).random(lower_bounds.size) * (
+        upper_bounds - lower_bounds
+    )
+    result, _ = downhill_simplex(
+        simplex_coordinates(initial_point), function, args.nm_iterations,
+        args.tol, args.alpha, args.beta, args.gamma, callback=callback
+    )
+    return result, function.evaluations
+
+
+def run_sabc(function, lower_bounds, upper_bounds, population, args, callback, rng=None):
+    '''
+    SABC benchmark run, returning its result and number of evaluations
+    '''
+    result, _, evaluations = sabc_algorithm(
+        population, lower_bounds, upper_bounds, args.limit, args.abc_stop,
+        args.abc_iterations, function,
+        NelderMeadParams(args.nm_iterations, args.tol, args.alpha, args.beta, args.gamma),
+        callback=callback, rng=rng
+    )
+    return result, evaluations
+
+
+ALGORITHMS = {
+    'abc': run_abc,
+    'nm': run_nm,
+    'sabc': run_sabc
+}
+
+
+def benchmark_case(algorithm, function_name, n_vars, population, args, backend='numpy'):
+    '''
+    Execute args.runtimes runs of an algorithm on a benchmark function
+    (of the given backend, see compiled.py),
+    with the same random streams for every case, and return their measures:
+    evaluations per second, wall time, evaluations needed to get within
+    args.target of the global minimum and final error
+    '''
+    function = backend_functions(backend)[function_name]
+    minimum = MINIMA[function_name]
+    lower_bounds, upper_bounds = domain(function_name, n_vars)
+    times = []
+    evaluations = []
+    errors = []
+    to_target = []
+    for seed in np.random.SeedSequence(args.seed).spawn(args.runtimes):
+        reached = []
+
+        def callback(statistics):
+            if not reached and statistics['best_value'] - minimum <= args.target:
+                reached.append(statistics['evaluations'])
+
+        (result, n_evaluations), run_time = seeded_run(
+            partial(
+                ALGORITHMS[algorithm],
+                function, lower_bounds, upper_bounds, population, args, callback
+            ),
+            seed
+        )
+        times.append(run_time)
+        evaluations.append(n_evaluations)
+        errors.append(float(FUNCTIONS[function_name](result)) - minimum)
+        to_target.extend(reached)
+
+    return {
+        'algorithm': algorithm,
+        'function': function_name,
+        'dimensions': n_vars,
+        'population': population,
+        'backend': backend,
+        'wall_time': float(np.mean(times)),
+        'evaluations': float(np.mean(evaluations)),
+        'evaluations_per_second': float(np.sum(evaluations) / max(np.sum(times), 1e-12)),
+        'evaluations_to_target': float(np.median(to_target)) if to_target else None,
+        'success_rate': len(to_target) / args.runtimes,
+        'final_error': float(np.mean(errors))
+    }
+
+
+def benchmark_cases(args):
+    '''
+    Enumerate the (algorithm, function, dimensions, population, backend)
+    benchmark cases.
+    Nelder-Mead has no population, and functions defined for a given number
+    of variables are only run with it
+    '''
+    for function_name in args.functions:
+        dimensions = (
+            [DIMENSIONS[function_name]] if function_name in DIMENSIONS else args.dimensions
+        )
+        for n_vars in dimensions:
+            for algorithm in args.algorithms:
+                populations = [None] if algorithm == 'nm' else args.populations
+                for population in populations:
+                    for backend in args.backends:
+                        yield algorithm, function_name, n_vars, population, backend
+
+
+def case_key(case):
+    '''
+    Return the identity of a benchmark case
+    (cases of earlier benchmarks without a backend ran with NumPy)
+    '''
+    return (
+        case['algorithm'], case['function'], case['dimensions'], case['population'],
+        case.get('backend', 'numpy')
+    )
+
+
+def backend_speedups(cases):
+    '''
+    Return the throughput speedup of each case over the same case
+    run with the NumPy backend
+    '''
+    reference = {case_key(case)[:-1]: case for case in cases if case['backend'] == 'numpy'}
+    return [
+        (case, case['evaluations_per_second'] / base['evaluations_per_second'])
+        for case in cases if case['backend'] != 'numpy'
+        for base in [reference.get(case_key(case)[:-1])] if base is not None
+    ]
+
+
+def compare(cases, baseline, threshold):
+    '''
+    Compare the throughput of the given cases with the ones of a baseline,
+    returning the cases slower by more than the given fraction
+    (with their baseline throughput and their speedup)
+    '''
+    reference = {case_key(case): case for case in baseline}
+    regressions = []
+    for case in cases:
+        base = reference.get(case_key(case))
+        if base is None:
+            continue
+        case['baseline_evaluations_per_second'] = base['evaluations_per_second']
+        case['speedup'] = case['evaluations_per_second'] / base['evaluations_per_second']
+        if case['speedup'] < 1 - threshold:
+            regressions.append(case)
+    return regressions
+
+
+def print_case(case, file=sys.stdout):
+    '''
+    Print the measures of a benchmark case
+    '''
+    to_target = case['evaluations_to_target']
+    print(
+        f"{case['algorithm']:<6}{case['function']:<12}{case['dimensions']:>5}"
+        f"{case['population'] or '-':>6}{case.get('backend', 'numpy'):>8}"
+        f"{case['wall_time']:>12.4f}"
+        f"{case['evaluations_per_second']:>14.0f}"
+        f"{'-' if to_target is None else f'{to_target:.0f}':>12}"
+        f"{case['final_error']:>14.4e}"
+        + (f"{case['speedup']:>9.2f}x" if 'speedup' in case else ''),
+        file=file
+    )
+
+
+def benchmark_cli_parser():
+    '''
+    Create a standard input arguments parser
+    '''
+    parser = argparse.ArgumentParser(
+        prog='benchmark', description='Benchmark suite of the implemented algorithms'
+    )
+    parser.add_argument(
+        '-a', '--algorithms', action='store', default=list(ALGORITHMS), nargs='+',
+        type=str, choices=ALGORITHMS.keys(), help='benchmarked algorithms'
+    )
+    parser.add_argument(
+        '-f', '--functions', action='store', default=list(FUNCTIONS), nargs='+',
+        type=str, choices=FUNCTIONS.keys(), help='benchmark functions'
+    )
+    parser.add_argument(
+        '-d', '--dimensions', action='store', default=[2, 10], nargs='+',
+        type=int, help='numbers of variables'
+    )
+    parser.add_argument(
+        '-p', '--populations', action='store', default=[50], nargs='+',
+        type=int, help='numbers of food sources'
+    )
+    parser.add_argument(
+        '-b', '--backends', action='store', default=['numpy'], nargs='+',
+        type=str, choices=BACKENDS, help='implementations of the functions and kernels'
+    )
+    parser.add_argument(
+        '-l', '--limit', action='store', default=20,
+        type=int, help='trails limit'
+    )
+    parser.add_argument(
+        '--abc_iterations', action='store', default=500,
+        type=int, help='maximum number of ABC iterations'
+    )
+    parser.add_argument(
+        '-c', '--abc_stop', action='store', default=100,
+        type=int, help='maximum number of non-changing best value before stopping'
+    )
+    parser.add_argument(
+        '--nm_iterations', action='store', default=1000,
+        type=int, help='maximum number of Nelder-Mead iterations'
+    )
+    parser.add_argument(
+        '-t', '--tol', action='store', default=1e-5,
+        type=float, help='tolerance for the Nelder-Mead stopping criteria'
+    )
+    parser.add_argument(
+        '--alpha', action='store', default=1,
+        type=float, help='coefficient for reflection'
+    )
+    parser.add_argument(
+        '--beta', action='store', default=0.5,
+        type=float, help='coefficient for contraction'
+    )
+    parser.add_argument(
+        '--gamma', action='store', default=2,
+        type=float, help='coefficient for expansion'
+    )
+    parser.add_argument(
+        '--target', action='store', default=1e-3,
+        type=float, help='distance from the global minimum counting as reached'
+    )
+    parser.add_argument(
+        '-r', '--runtimes', action='store', default=3,
+        type=int, help='number of executions of each case'
+    )
+    parser.add_argument(
+        '--seed', action='store', default=0,
+        type=int, help='seed of the random streams of the executions'
+    )
+    parser.add_argument(
+        '-o', '--output', action='store', default=None,
+        type=str, help='JSON file where the results are written'
+    )
+    parser.add_argument(
+        '--baseline', action='store', default=None,
+        type=str, help='JSON results of a previous benchmark to compare with'
+    )
+    parser.add_argument(
+        '--threshold', action='store', default=0.1,
+        type=float, help='throughput loss with respect to the baseline flagged as a regression'
+    )
+    return parser
+
+
+def main():
+    parser = benchmark_cli_parser()
+    args = parser.parse_args()
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['cases']
+
+    if 'numba' in args.backends:
+        warm_up()
+
+    print(
+        f"{'Alg.':<6}{'Function':<12}{'Dims':>5}{'Pop.':>6}{'Backend':>8}{'Time (s)':>12}"
+        f"{'Evals/s':>14}{'To target':>12}{'Error':>14}"
+        + (f"{'Speedup':>10}" if baseline is not None else '')
+    )
+    cases = []
+    regressions = []
+    for algorithm, function_name, n_vars, population, backend in benchmark_cases(args):
+        case = benchmark_case(algorithm, function_name, n_vars, population, args, backend)
+        if baseline is not None:
+            regressions += compare([case], baseline, args.threshold)
+        print_case(case)
+        cases.append(case)
+
+    speedups = backend_speedups(cases)
+    if speedups:
+        print('Backend speedups over NumPy:')
+        for case, speedup in speedups:
+            print(
+                f"{case['algorithm']:<6}{case['function']:<12}{case['dimensions']:>5}"
+                f"{case['population'] or '-':>6}{case['backend']:>8}{speedup:>9.2f}x"
+            )
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({'settings': vars(args), 'cases': cases}, f, indent=2)
+    if regressions:
+        print(f'{len(regressions)} throughput regressions beyond {args.threshold:.0%}:')
+        for case in regressions:
+            print_case(case)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
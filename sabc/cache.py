@@ -0,0 +1,164 @@
+'''
+Objective function evaluations cache
+'''
+
+
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def function_key(function):
+    '''
+    Return the identity of an objective function used in the cache keys.
+    Functions without a stable qualified name (lambdas, closures, callables)
+    are identified by their repr, so they are not shared across processes
+    '''
+    key = getattr(function, 'cache_key', None)
+    if key is not None:
+        return key
+    module = getattr(function, '__module__', None)
+    name = getattr(function, '__qualname__', None)
+    if module is None or name is None or '<' in name:
+        return repr(function)
+    return f'{module}.{name}'
+
+
+def cli_cache(cache_size=None, cache_file=None):
+    '''
+    Return the evaluations cache described by the CLI arguments,
+    or None if neither its size nor its file are given
+    '''
+    if cache_size is None and cache_file is None:
+        return None
+    return EvaluationCache(cache_size or 2 ** 16, cache_file)
+
+
+class EvaluationCache:
+    '''
+    Tiered cache of objective function values: a bounded in-memory LRU,
+    optionally backed by a persistent SQLite store at the given path.
+    Values are keyed by the function identity and the exact bytes of the point
+    '''
+
+    def __init__(self, maxsize=2 ** 16, path=None):
+        assert(maxsize > 0)
+        self.maxsize = maxsize
+        self.path = path
+        self.memory = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.db = None
+        if path is not None:
+            self.db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+            self.db.execute(
+                'CREATE TABLE IF NOT EXISTS evaluations ('
+                'function TEXT, point BLOB, value REAL, PRIMARY KEY (function, point))'
+            )
+            self.db.commit()
+
+    def get(self, key):
+        '''
+        Return the cached value of the given key, or None
+        (counting a miss)
+        '''
+        value = self.memory.get(key)
+        if value is not None:
+            self.memory.move_to_end(key)
+            self.hits += 1
+            return value
+        if self.db is not None:
+            row = self.db.execute(
+                'SELECT value FROM evaluations WHERE function = ? AND point = ?', key
+            ).fetchone()
+            if row is not None and row[0] is not None:
+                self.remember(key, row[0])
+                self.disk_hits += 1
+                return row[0]
+        self.misses += 1
+        return None
+
+    def remember(self, key, value):
+        '''
+        Store a value in the in-memory LRU, evicting the oldest one if full
+        '''
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+        if len(self.memory) > self.maxsize:
+            self.memory.popitem(last=False)
+
+    def put(self, keys, values):
+        '''
+        Store the given values in all the tiers
+        '''
+        for key, value in zip(keys, values):
+            self.remember(key, value)
+        if self.db is not None:
+            self.db.executemany(
+                'INSERT OR REPLACE INTO evaluations VALUES (?, ?, ?)',
+                [(*key, value) for key, value in zip(keys, values)]
+            )
+            self.db.commit()
+
+    def evaluate(self, function, points, evaluate):
+        '''
+        Return the values of a (n_points, n_vars) matrix of points of the given
+        function, computing only the missing ones (once for repeated points)
+        with a single evaluate call
+        '''
+        name = function_key(function)
+        points = np.asarray(points, dtype=float)
+        keys = [(name, np.ascontiguousarray(point).tobytes()) for point in points]
+        values = np.empty(len(points))
+        missing = OrderedDict()
+        with self.lock:
+            for i, key in enumerate(keys):
+                if key in missing:
+                    self.hits += 1
+                    missing[key].append(i)
+                    continue
+                value = self.get(key)
+                if value is None:
+                    missing.setdefault(key, []).append(i)
+                else:
+                    values[i] = value
+        if missing:
+            computed = evaluate(points[[indexes[0] for indexes in missing.values()]])
+            for indexes, value in zip(missing.values(), computed):
+                values[indexes] = value
+            with self.lock:
+                self.put(list(missing), np.asarray(computed, dtype=float).tolist())
+        return values
+
+    def stats(self):
+        '''
+        Return the hit/miss statistics of the cache
+        '''
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else 0.
+        }
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __getstate__(self):
+        return {'maxsize': self.maxsize, 'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state['maxsize'], state['path'])
@@ -0,0 +1,44 @@
+'''
+Checkpointing of the ABC colony state
+'''
+
+
+import json
+import os
+
+import numpy as np
+
+
+def save_checkpoint(path, rng, **colony):
+    '''
+    Atomically save the given colony state (None entries are skipped),
+    along with the state of the given random generator, to a .npz file
+    '''
+    arrays = {key: value for key, value in colony.items() if value is not None}
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, rng_state=json.dumps(rng.bit_generator.state), **arrays)
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(path, rng):
+    '''
+    Load a colony state saved by save_checkpoint, restoring the state
+    of the given random generator (0-d arrays are returned as scalars)
+    '''
+    with np.load(path) as data:
+        colony = {key: data[key] for key in data.files}
+    rng.bit_generator.state = json.loads(colony.pop('rng_state').item())
+    return {
+        key: value.item() if value.ndim == 0 else value for key, value in colony.items()
+    }
+
+
+def checkpoint_path(path, run, runtimes):
+    '''
+    Return the checkpoint file of the given run, out of runtimes executions
+    '''
+    if path is None or runtimes == 1:
+        return path
+    root, ext = os.path.splitext(path)
+    return f'{root}.{run}{ext}'
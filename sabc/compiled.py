@@ -0,0 +1,278 @@
+'''
+Compiled backend of the benchmark functions and of the bees kernels,
+available when Numba is installed
+'''
+
+
+import math
+from functools import partial
+
+import numpy as np
+
+import utils
+from utils import batched
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+BACKENDS = ('numpy',) if njit is None else ('numpy', 'numba')
+
+
+def compile_kernel(kernel=None, cache=True):
+    '''
+    Compile a kernel with Numba (caching it on disk, if cache is set),
+    or leave it as it is if Numba is not installed
+    '''
+    if kernel is None:
+        return partial(compile_kernel, cache=cache)
+    return kernel if njit is None else njit(cache=cache)(kernel)
+
+
+@compile_kernel
+def block_sum(a, start, n):
+    '''
+    Sum at most 128 elements of a from start, in the same order as NumPy
+    (with 8 accumulators, from 8 elements on)
+    '''
+    if n < 8:
+        result = 0.0
+        for i in range(start, start + n):
+            result += a[i]
+        return result
+    r = a[start:start + 8].copy()
+    i = 8
+    while i < n - n % 8:
+        for k in range(8):
+            r[k] += a[start + i + k]
+        i += 8
+    result = ((r[0] + r[1]) + (r[2] + r[3])) + ((r[4] + r[5]) + (r[6] + r[7]))
+    for k in range(i, n):
+        result += a[start + k]
+    return result
+
+
+@compile_kernel
+def pairwise_sum(a, start, n):
+    '''
+    Sum n elements of a from start, in the same order as NumPy (splitting them
+    in halves down to blocks of at most 128 elements, see block_sum), so that
+    compiled sums are identical to the NumPy ones.
+    The halves are walked with an explicit stack, since Numba cannot cache
+    recursive kernels
+    '''
+    if n <= 128:
+        return block_sum(a, start, n)
+    starts = np.empty(64, dtype=np.int64)
+    sizes = np.empty(64, dtype=np.int64)
+    stages = np.zeros(64, dtype=np.int64)
+    lefts = np.empty(64)
+    starts[0] = start
+    sizes[0] = n
+    top = 0
+    value = 0.0
+    while top >= 0:
+        size = sizes[top]
+        half = size // 2
+        half -= half % 8
+        if size <= 128:
+            value = block_sum(a, starts[top], size)
+            top -= 1
+        elif stages[top] == 0:
+            # Sum the first half
+            stages[top] = 1
+            top += 1
+            starts[top], sizes[top], stages[top] = starts[top - 1], half, 0
+        elif stages[top] == 1:
+            # Sum the second half
+            lefts[top] = value
+            stages[top] = 2
+            top += 1
+            starts[top], sizes[top], stages[top] = starts[top - 1] + half, size - half, 0
+        else:
+            value = lefts[top] + value
+            top -= 1
+    return value
+
+
+@compile_kernel
+def rosenbrock_kernel(x):
+    terms = np.empty(x.size - 1)
+    for i in range(x.size - 1):
+        terms[i] = 100 * ((x[i + 1] - x[i] ** 2) ** 2) + (1 - x[i]) ** 2
+    return pairwise_sum(terms, 0, terms.size)
+
+
+@compile_kernel
+def sixhump_kernel(x):
+    x1, x2 = x[0], x[1]
+    return (
+        (4 - 2.1 * (x1 ** 2) + (x1 ** 4) / 3.) *
+        (x1 ** 2) + x1 * x2 + (-4 + 4 * (x2**2)) * (x2 ** 2)
+    )
+
+
+@compile_kernel
+def rastrigin_kernel(x):
+    terms = np.empty(x.size)
+    for i in range(x.size):
+        terms[i] = (x[i] ** 2) - 10 * math.cos(2 * np.pi * x[i])
+    return (10 * x.size) + pairwise_sum(terms, 0, terms.size)
+
+
+E = np.exp(1)
+
+
+@compile_kernel
+def ackley_kernel(x):
+    squares = np.empty(x.size)
+    cosines = np.empty(x.size)
+    for i in range(x.size):
+        squares[i] = x[i] ** 2
+        cosines[i] = math.cos(2 * np.pi * x[i])
+    n_vars = x.size
+    return (
+        (20 - 20 * math.exp(
+            -0.2 * math.sqrt((1 / n_vars) * max(pairwise_sum(squares, 0, n_vars), 0))
+        ) + E - math.exp((1 / n_vars) * pairwise_sum(cosines, 0, n_vars)))
+    )
+
+
+@compile_kernel
+def schaffer_kernel(x):
+    terms = np.empty(x.size - 1)
+    for i in range(x.size - 1):
+        s = (x[i] ** 2) + (x[i + 1] ** 2)
+        terms[i] = (s ** 0.25) * (((math.sin(50 * s ** 0.10)) ** 2) + 1)
+    return pairwise_sum(terms, 0, terms.size)
+
+
+# Kernels taking other kernels as arguments cannot be cached by Numba
+@compile_kernel(cache=False)
+def evaluate_rows(kernel, points):
+    '''
+    Evaluate each row of a matrix of points with the given kernel
+    '''
+    values = np.empty(points.shape[0])
+    for i in range(points.shape[0]):
+        values[i] = kernel(points[i])
+    return values
+
+
+def evaluate(kernel, x):
+    '''
+    Evaluate a point, or each point of an array of points, with the given kernel
+    '''
+    x = np.asarray(x, dtype=float)
+    if x.ndim == 1:
+        return kernel(x)
+    return evaluate_rows(kernel, x.reshape(-1, x.shape[-1])).reshape(x.shape[:-1])
+
+
+# Kernels taking other kernels as arguments cannot be cached by Numba
+@compile_kernel(cache=False)
+def move_bees(kernel, food_sources, values, fitnesses, trails, lower_bounds, upper_bounds,
+              bees, d, partners, phi):
+    '''
+    Move the given bees one after the other (see abeec.move_food_sources),
+    evaluating their candidates with the given kernel
+    and updating the food sources, values, fitnesses and trails in place
+    '''
+    candidate = np.empty(food_sources.shape[1])
+    for k in range(bees.size):
+        i, d_k = bees[k], d[k]
+        x_d = food_sources[i, d_k]
+        x_d += phi[k] * (x_d - food_sources[partners[k], d_k])
+
+        # Shift onto boundaries
+        if x_d > upper_bounds[d_k]:
+            x_d = upper_bounds[d_k]
+        elif x_d < lower_bounds[d_k]:
+            x_d = lower_bounds[d_k]
+
+        candidate[:] = food_sources[i]
+        candidate[d_k] = x_d
+        value = kernel(candidate)
+        food_fitness = 1 / (1 + abs(value)) if value >= 0 else 1 + abs(value)
+        if fitnesses[i] < food_fitness:
+            food_sources[i, d_k] = x_d
+            values[i] = value
+            fitnesses[i] = food_fitness
+            trails[i] = 0
+        else:
+            trails[i] += 1
+
+
+def compiled_kernel(function):
+    '''
+    Return the kernel of a CountedFunction of a compiled function,
+    if it can be called directly (i.e. without evaluator nor cache)
+    '''
+    if function.evaluator is not None or function.cache is not None:
+        return None
+    return getattr(function.function, 'kernel', None)
+
+
+@batched
+def rosenbrock(x):
+    return evaluate(rosenbrock_kernel, x)
+
+
+@batched
+def sixhump(x):
+    return evaluate(sixhump_kernel, x)
+
+
+@batched
+def rastrigin(x):
+    return evaluate(rastrigin_kernel, x)
+
+
+@batched
+def ackley(x):
+    return evaluate(ackley_kernel, x)
+
+
+@batched
+def schaffer(x):
+    return evaluate(schaffer_kernel, x)
+
+
+rosenbrock.kernel = rosenbrock_kernel
+sixhump.kernel = sixhump_kernel
+rastrigin.kernel = rastrigin_kernel
+ackley.kernel = ackley_kernel
+schaffer.kernel = schaffer_kernel
+
+FUNCTIONS = {
+    'ackley': ackley,
+    'rastrigin': rastrigin,
+    'rosenbrock': rosenbrock,
+    'schaffer': schaffer,
+    'sixhump': sixhump
+}
+
+
+def backend_functions(backend='numpy'):
+    '''
+    Return the benchmark functions of the given backend
+    '''
+    assert(backend in BACKENDS)
+    return FUNCTIONS if backend == 'numba' else utils.FUNCTIONS
+
+
+def warm_up():
+    '''
+    Compile the kernels ahead of their timed executions
+    '''
+    point = np.zeros(2)
+    for function in FUNCTIONS.values():
+        function(point)
+        function(np.zeros((2, 2)))
+        move_bees(
+            function.kernel, np.zeros((2, 2)), np.zeros(2), np.ones(2), np.zeros(2),
+            -np.ones(2), np.ones(2), np.arange(2), np.zeros(2, dtype=np.int64),
+            np.arange(2)[::-1].copy(), np.zeros(2)
+        )
@@ -0,0 +1,115 @@
+'''
+Re-entrant optimizer engine running ABC and SABC solves
+'''
+
+
+import copy
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from abeec import iter_abc
+from amoeba import NelderMeadParams
+from sabeec import iter_sabc
+from streaming import drain
+
+
+SCOUTS = ('abc', 'sabc')
+
+
+class Optimizer:
+    '''
+    Optimizer engine whose scout bees stage, evaluator, cache and stopping
+    policy are per-instance components, so that many independent solves
+    (of plain ABC and SABC engines alike) can share a long-lived process
+    and run concurrently in its threads.
+    The scout is 'abc' (random renewal), 'sabc' (Nelder-Mead refinement
+    with the given parameters, asynchronous over scout_workers threads
+    if given) or a callable with the signature of abeec.renew_food_sources.
+    The budget (see termination.Budget) is a template copied for each solve,
+    while the evaluator and cache are shared by all the solves.
+    The remaining options are passed to abc_algorithm
+    '''
+
+    def __init__(self, scout='abc', nelder_mead=NelderMeadParams(), scout_workers=0,
+                 evaluator=None, cache=None, budget=None, limit=20, abc_stop=100,
+                 abc_iterations=3000, workers=1, **options):
+        assert(scout in SCOUTS or callable(scout))
+        assert(scout_workers >= 0)
+        assert(workers > 0)
+        self.scout = scout
+        self.nelder_mead = NelderMeadParams(*nelder_mead)
+        self.scout_workers = scout_workers
+        self.evaluator = evaluator
+        self.cache = cache
+        self.budget = budget
+        self.limit = limit
+        self.abc_stop = abc_stop
+        self.abc_iterations = abc_iterations
+        self.workers = workers
+        self.options = options
+        self.executor = None
+        self.lock = threading.Lock()
+
+    def iterate(self, function, n_food_sources, lower_bounds, upper_bounds, rng=None, **kwargs):
+        '''
+        Iterations of a solve of the function within the given bounds,
+        with the given random generator (or seed) and abc_algorithm options
+        overriding the ones of the engine, yielding a snapshot after each
+        iteration (see streaming.Snapshot).
+        Return the best food source, the number of iterations
+        and the number of objective function evaluations
+        '''
+        options = {
+            'evaluator': self.evaluator, 'cache': self.cache,
+            'budget': copy.copy(self.budget), **self.options, **kwargs
+        }
+        args = (
+            n_food_sources, lower_bounds, upper_bounds,
+            self.limit, self.abc_stop, self.abc_iterations, function
+        )
+        if self.scout == 'sabc':
+            return iter_sabc(
+                *args, self.nelder_mead, scout_workers=self.scout_workers, rng=rng, **options
+            )
+        if callable(self.scout):
+            options['scout'] = self.scout
+        return iter_abc(*args, rng=rng, **options)
+
+    def solve(self, function, n_food_sources, lower_bounds, upper_bounds, rng=None, **kwargs):
+        '''
+        Run all the iterations of a solve (see iterate), returning its result
+        '''
+        return drain(
+            self.iterate(function, n_food_sources, lower_bounds, upper_bounds, rng=rng, **kwargs)
+        )
+
+    def submit(self, function, n_food_sources, lower_bounds, upper_bounds, rng=None, **kwargs):
+        '''
+        Schedule a solve over the thread pool of the engine
+        (created on first use with its number of workers), returning its future
+        '''
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        return self.executor.submit(
+            self.solve, function, n_food_sources, lower_bounds, upper_bounds, rng=rng, **kwargs
+        )
+
+    def close(self):
+        '''
+        Wait for the scheduled solves and release the thread pool,
+        the evaluator and the cache of the engine
+        '''
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
+        for component in (self.evaluator, self.cache):
+            if component is not None:
+                component.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,102 @@
+'''
+Objective function evaluators
+'''
+
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+
+from utils import SHIPPED, evaluate_batch, is_batched
+
+
+class SerialEvaluator:
+    '''
+    Evaluate batches of points in the calling thread
+    '''
+
+    def __init__(self, workers=None):
+        self.workers = 1
+
+    def evaluate(self, function, points):
+        return evaluate_batch(function, points)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class PoolEvaluator(SerialEvaluator):
+    '''
+    Evaluate batches of points concurrently over a pool of workers.
+    Batched functions get one chunk of points per worker, while
+    scalar-only functions get one task per point.
+    The pool is created on first use, so that evaluators can be
+    shipped to other processes before being used
+    '''
+
+    executor_class = None
+
+    def __init__(self, workers=None):
+        assert(workers is None or workers > 0)
+        self.workers = workers or os.cpu_count() or 1
+        self.executor = None
+        self.lock = threading.Lock()
+
+    def evaluate(self, function, points):
+        if len(points) == 0:
+            return np.empty(0)
+        with self.lock:
+            if self.executor is None:
+                self.executor = self.executor_class(max_workers=self.workers)
+        n_chunks = min(self.workers, len(points)) if is_batched(function) else len(points)
+        chunks = np.array_split(points, n_chunks)
+        return np.concatenate(list(self.executor.map(
+            partial(evaluate_batch, function), chunks,
+            chunksize=max(1, n_chunks // (4 * self.workers))
+        )))
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def __getstate__(self):
+        return {'workers': self.workers}
+
+    def __setstate__(self, state):
+        self.__init__(state['workers'])
+        SHIPPED.append(self)
+
+
+class ThreadPoolEvaluator(PoolEvaluator):
+    '''
+    Evaluate batches of points over a pool of threads,
+    suited to objectives releasing the GIL (I/O, subprocesses, NumPy)
+    '''
+
+    executor_class = ThreadPoolExecutor
+
+
+class ProcessPoolEvaluator(PoolEvaluator):
+    '''
+    Evaluate batches of points over a pool of processes,
+    suited to CPU-bound pure Python objectives (which must be picklable)
+    '''
+
+    executor_class = ProcessPoolExecutor
+
+
+EVALUATORS = {
+    'serial': SerialEvaluator,
+    'thread': ThreadPoolEvaluator,
+    'process': ProcessPoolEvaluator
+}
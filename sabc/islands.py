@@ -0,0 +1,160 @@
+'''
+Island model: multiple colonies exchanging their best food sources
+'''
+
+
+import copy
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+
+from checkpoint import checkpoint_path
+from utils import seeded_run
+
+try:
+    from multiprocessing.shared_memory import SharedMemory
+except ImportError:
+    # Python 3.7
+    SharedMemory = None
+
+
+TOPOLOGIES = ('ring', 'full')
+
+# Lock of the shared migration buffer, set in each island process
+migration_lock = None
+
+
+def init_island(lock):
+    '''
+    Initialize an island process with the lock of the migration buffer
+    '''
+    global migration_lock
+    migration_lock = lock
+
+
+def neighbours(island, n_islands, topology):
+    '''
+    Return the islands whose best food sources migrate to the given one
+    '''
+    if topology == 'ring':
+        return np.array([(island - 1) % n_islands])
+    return np.delete(np.arange(n_islands), island)
+
+
+class Migration:
+    '''
+    Migration of an island colony: every `every` iterations, its best
+    food source and value are published in its row of a shared
+    (n_islands, n_vars + 1) buffer, and the best food sources of its
+    neighbours replace its worst food sources when they are better.
+    Only the best food sources cross the processes, through shared memory
+    '''
+
+    def __init__(self, bests, island, topology, every):
+        assert(every > 0)
+        self.bests = bests
+        self.island = island
+        self.neighbours = neighbours(island, len(bests), topology)
+        self.every = every
+
+    def __call__(self, iterations, food_sources, values):
+        '''
+        Exchange the best food sources of the colony, replacing its worst
+        food sources (and values) in place.
+        Return the indexes of the replaced food sources
+        '''
+        if iterations % self.every != 0:
+            return np.empty(0, dtype=int)
+        best = np.argmin(values)
+        with migration_lock:
+            self.bests[self.island, :-1] = food_sources[best]
+            self.bests[self.island, -1] = values[best]
+            immigrants = np.array(self.bests[self.neighbours], copy=True)
+
+        # The best immigrants replace the worst food sources they improve
+        # (islands which have not published yet have an infinite value)
+        immigrants = immigrants[np.argsort(immigrants[:, -1])]
+        worst = np.argsort(values)[::-1][:len(immigrants)]
+        better = immigrants[:len(worst), -1] < values[worst]
+        replaced = worst[better]
+        food_sources[replaced] = immigrants[:len(worst)][better, :-1]
+        values[replaced] = immigrants[:len(worst)][better, -1]
+        return replaced
+
+
+def island_budget(budget, island, n_islands):
+    '''
+    Return the budget of an island: a copy of the given one (if any),
+    with its share of the maximum number of evaluations
+    '''
+    if budget is None:
+        return None
+    budget = copy.copy(budget)
+    if budget.max_evaluations is not None:
+        share, remainder = divmod(budget.max_evaluations, n_islands)
+        budget.max_evaluations = max(1, share + (island < remainder))
+    return budget
+
+
+def run_island(algorithm, name, island, n_islands, n_vars, topology, every, *args, **kwargs):
+    '''
+    Execute the algorithm of an island, attached to the shared migration buffer
+    '''
+    shared = SharedMemory(name=name)
+    bests = np.ndarray((n_islands, n_vars + 1), dtype=float, buffer=shared.buf)
+    result = algorithm(*args, migrate=Migration(bests, island, topology, every), **kwargs)
+    del bests
+    shared.close()
+    return result
+
+
+def island_algorithm(algorithm, n_islands, n_food_sources, lower_bounds, upper_bounds,
+                     limit, abc_stop, abc_iterations, function, *args,
+                     migration_every=10, topology='ring', rng=None, checkpoint=None, budget=None,
+                     **kwargs):
+    '''
+    Island model of the given algorithm (abc_algorithm or sabc_algorithm):
+    n_islands independent colonies of n_food_sources each run in their
+    own process and exchange their best food sources every migration_every
+    iterations (see Migration), along a ring or a fully connected topology.
+    Each island gets its own random generator, spawned from a seed drawn
+    from the given generator (or seed) and, if a checkpoint is given,
+    its own checkpoint file. Each island also gets its own copy of the
+    budget, sharing out its maximum number of evaluations (see island_budget).
+    Return the best food source of all the islands, the maximum number
+    of iterations and the total number of evaluations
+    '''
+    assert(n_islands > 0)
+    assert(topology in TOPOLOGIES)
+    if SharedMemory is None:
+        raise RuntimeError('the island model requires Python 3.8 or later')
+    n_vars = len(lower_bounds)
+    shared = SharedMemory(create=True, size=n_islands * (n_vars + 1) * 8)
+    try:
+        np.ndarray((n_islands, n_vars + 1), dtype=float, buffer=shared.buf)[:] = np.inf
+        seeds = np.random.SeedSequence(
+            int(np.random.default_rng(rng).integers(2 ** 63))
+        ).spawn(n_islands)
+        with ProcessPoolExecutor(
+                max_workers=n_islands, initializer=init_island,
+                initargs=(multiprocessing.Lock(),)) as executor:
+            futures = [
+                executor.submit(seeded_run, partial(
+                    run_island, algorithm, shared.name, island, n_islands, n_vars,
+                    topology, migration_every, n_food_sources, lower_bounds, upper_bounds,
+                    limit, abc_stop, abc_iterations, function, *args,
+                    checkpoint=checkpoint_path(checkpoint, island, n_islands),
+                    budget=island_budget(budget, island, n_islands), **kwargs
+                ), island_seed)
+                for island, island_seed in enumerate(seeds)
+            ]
+            results = [future.result()[0] for future in futures]
+    finally:
+        shared.close()
+        shared.unlink()
+
+    food_sources, iterations, evaluations = zip(*results)
+    best = np.argmin([function(food_source) for food_source in food_sources])
+    return food_sources[best], max(iterations), sum(evaluations)
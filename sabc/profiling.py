@@ -0,0 +1,112 @@
+'''
+Optimizers instrumentation
+'''
+
+
+import json
+import sys
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+
+
+class Profile:
+    '''
+    Per-stage wall-clock times and objective function evaluations
+    of an optimizer run, along with per-iteration statistics
+    '''
+
+    def __init__(self):
+        self.times = defaultdict(float)
+        self.evaluations = defaultdict(int)
+        self.calls = defaultdict(int)
+        self.history = []
+
+    @contextmanager
+    def stage(self, name, function=None):
+        '''
+        Time a stage, counting the evaluations of the given CountedFunction
+        '''
+        start_evaluations = getattr(function, 'evaluations', 0)
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(
+                name, time.perf_counter() - start_time,
+                getattr(function, 'evaluations', 0) - start_evaluations
+            )
+
+    def add(self, name, elapsed, evaluations=0):
+        '''
+        Account a call of a stage
+        '''
+        self.times[name] += elapsed
+        self.evaluations[name] += evaluations
+        self.calls[name] += 1
+
+    def record(self, **iteration):
+        '''
+        Record the statistics of an iteration
+        '''
+        self.history.append(iteration)
+
+    def to_dict(self):
+        '''
+        Return the profile as a JSON-serializable dictionary
+        '''
+        return {
+            'stages': {
+                name: {
+                    'time': self.times[name],
+                    'evaluations': self.evaluations[name],
+                    'calls': self.calls[name]
+                }
+                for name in self.times
+            },
+            'iterations': self.history
+        }
+
+    def summary(self, file=sys.stdout):
+        '''
+        Print the per-stage breakdown
+        '''
+        total = sum(self.times.values()) or 1
+        print(f'{"Stage":<16}{"Time (s)":>12}{"Time (%)":>10}{"Evaluations":>13}{"Calls":>9}',
+              file=file)
+        for name in self.times:
+            print(
+                f'{name:<16}{self.times[name]:>12.6f}{100 * self.times[name] / total:>10.2f}'
+                f'{self.evaluations[name]:>13}{self.calls[name]:>9}', file=file
+            )
+
+
+def stage(profile, name, function=None):
+    '''
+    Return the timer of a stage of the given profile, if any
+    '''
+    return nullcontext() if profile is None else profile.stage(name, function)
+
+
+def with_profile(run, **kwargs):
+    '''
+    Execute the given optimizer run with a new profile (and the given
+    keyword arguments), returning its result and its profile
+    '''
+    profile = Profile()
+    return run(profile=profile, **kwargs), profile
+
+
+def write_profiles(profiles, path='-'):
+    '''
+    Print the breakdown of the given profiles, or export them as JSON
+    to the given path
+    '''
+    if path != '-':
+        with open(path, 'w') as f:
+            json.dump([profile.to_dict() for profile in profiles], f, indent=2)
+        return
+    for i, profile in enumerate(profiles):
+        if len(profiles) > 1:
+            print(f'Profile of execution {i}:')
+        profile.summary()
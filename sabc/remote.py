@@ -0,0 +1,434 @@
+'''
+Remote objective functions served by long-running worker processes
+over Unix or TCP sockets, and a stand-in worker serving the benchmark functions
+'''
+
+
+import argparse
+import itertools
+import os
+import socket
+import socketserver
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+import numpy as np
+
+from compiled import BACKENDS, backend_functions
+from utils import FUNCTIONS, evaluate_batch
+
+
+# Requests: request id, number of points and number of variables, followed by the points.
+# Responses: request id and number of values, followed by the values (or, if negative,
+# minus the length of the error message following them).
+# Points and values are raw little-endian float64 buffers
+REQUEST = struct.Struct('<QII')
+RESPONSE = struct.Struct('<Qq')
+FLOAT = np.dtype('<f8')
+
+
+class RemoteError(Exception):
+    '''
+    Error raised by the objective function of a worker
+    '''
+
+
+def parse_address(address):
+    '''
+    Parse a host:port TCP address, or any other string as a Unix socket path
+    '''
+    if isinstance(address, tuple):
+        return address
+    host, _, port = address.rpartition(':')
+    if host and port.isdigit() and '/' not in address:
+        return host, int(port)
+    return address
+
+
+def socket_family(address):
+    return socket.AF_INET if isinstance(address, tuple) else socket.AF_UNIX
+
+
+def receive_exactly(sock, n):
+    '''
+    Receive exactly n bytes from a socket
+    '''
+    data = bytearray(n)
+    view = memoryview(data)
+    received = 0
+    while received < n:
+        size = sock.recv_into(view[received:])
+        if size == 0:
+            raise ConnectionError('connection closed by the worker')
+        received += size
+    return data
+
+
+class Connection:
+    '''
+    Persistent connection to a worker, opened on first use (and reopened
+    after a failure). Requests are pipelined: they are sent without waiting
+    for the previous responses, which a reader thread matches to the futures
+    of their requests. On a failure, all the pending requests fail
+    with a ConnectionError
+    '''
+
+    def __init__(self, address, connect_timeout=5):
+        self.address = address
+        self.connect_timeout = connect_timeout
+        self.socket = None
+        self.pending = {}
+        self.ids = itertools.count()
+        self.failed_at = None
+        self.lock = threading.Lock()
+
+    def open(self):
+        sock = socket.socket(socket_family(self.address), socket.SOCK_STREAM)
+        sock.settimeout(self.connect_timeout)
+        try:
+            sock.connect(self.address)
+        except OSError:
+            sock.close()
+            raise
+        sock.settimeout(None)
+        if sock.family == socket.AF_INET:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.socket = sock
+        self.failed_at = None
+        threading.Thread(target=self.read, args=(sock,), daemon=True).start()
+
+    def submit(self, points):
+        '''
+        Send a batch of points, returning the future of their values
+        '''
+        future = Future()
+        with self.lock:
+            try:
+                if self.socket is None:
+                    self.open()
+                request_id = next(self.ids)
+                self.pending[request_id] = future
+                self.socket.sendall(REQUEST.pack(request_id, *points.shape) + points.tobytes())
+            except OSError as error:
+                self.fail(self.socket, error)
+                self.failed_at = time.monotonic()
+                if not future.done():
+                    future.set_exception(ConnectionError(f'{self.address}: {error}'))
+        return future
+
+    def read(self, sock):
+        '''
+        Resolve the futures of the responses of a connection until it fails
+        '''
+        try:
+            while True:
+                request_id, n = RESPONSE.unpack(receive_exactly(sock, RESPONSE.size))
+                if n < 0:
+                    message = receive_exactly(sock, -n).decode()
+                    result = RemoteError(message)
+                else:
+                    result = np.frombuffer(receive_exactly(sock, n * FLOAT.itemsize), FLOAT)
+                with self.lock:
+                    future = self.pending.pop(request_id, None)
+                if future is None:
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+        except OSError as error:
+            with self.lock:
+                self.fail(sock, error)
+
+    def fail(self, sock, error):
+        '''
+        Close the given socket of the connection (if still current),
+        failing its pending requests
+        '''
+        if sock is None or sock is not self.socket:
+            return
+        self.socket = None
+        self.failed_at = time.monotonic()
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        sock.close()
+        for future in self.pending.values():
+            future.set_exception(ConnectionError(f'{self.address}: {error}'))
+        self.pending = {}
+
+    def reset(self):
+        with self.lock:
+            self.fail(self.socket, 'request timed out')
+
+    def close(self):
+        with self.lock:
+            self.fail(self.socket, 'connection closed')
+            self.failed_at = None
+
+
+class RemoteObjective:
+    '''
+    Batched objective function evaluated by remote workers (see serve),
+    over a pool of persistent connections to their Unix or TCP addresses.
+    The points of each call are sent as raw float64 buffers, split in up to
+    pipeline requests per worker, all in flight at once.
+    Requests failing because of a worker (closed connection, or no
+    response within timeout seconds) are sent again to the other workers,
+    up to retries times; failed workers are only reconnected to
+    reconnect_delay seconds later (or when all of them failed).
+    Errors of the objective function itself raise a RemoteError.
+    The objective is identified in the evaluations cache (see cache.py)
+    by the given model name, which must change whenever the workers serve
+    another objective; without a model name, its cached evaluations are
+    never shared with other objectives.
+    Connections are opened on first use, so that remote objectives can be
+    shipped to other processes before being used
+    '''
+
+    batched = True
+
+    def __init__(self, addresses, model=None, pipeline=4, timeout=None, retries=3,
+                 reconnect_delay=1):
+        assert(len(addresses) > 0)
+        assert(pipeline > 0)
+        assert(timeout is None or timeout > 0)
+        assert(retries >= 0)
+        self.addresses = [parse_address(address) for address in addresses]
+        self.model = model
+        self.cache_key = f'remote:{uuid.uuid4() if model is None else model}'
+        self.pipeline = pipeline
+        self.timeout = timeout
+        self.retries = retries
+        self.reconnect_delay = reconnect_delay
+        self.connections = [Connection(address) for address in self.addresses]
+        self.rotation = itertools.count()
+
+    def available(self):
+        '''
+        Return the connections not failed for the last reconnect_delay
+        seconds (or all of them, if they all failed)
+        '''
+        now = time.monotonic()
+        connections = [
+            connection for connection in self.connections
+            if connection.failed_at is None or now - connection.failed_at >= self.reconnect_delay
+        ]
+        return connections or self.connections
+
+    def evaluate_points(self, points):
+        values = np.empty(len(points))
+        if len(points) == 0:
+            return values
+        bounds = np.linspace(
+            0, len(points), min(len(points), len(self.connections) * self.pipeline) + 1
+        ).astype(int)
+        remaining = list(zip(bounds[:-1], bounds[1:]))
+        for attempt in range(self.retries + 1):
+            connections = self.available()
+            if attempt > 0 and all(connection.failed_at for connection in connections):
+                # Give restarting workers some time
+                time.sleep(0.1 * attempt)
+            offset = next(self.rotation)
+            futures = [
+                (connections[(offset + k) % len(connections)], start, end)
+                for k, (start, end) in enumerate(remaining)
+            ]
+            futures = [
+                (connection, start, end, connection.submit(points[start:end]))
+                for connection, start, end in futures
+            ]
+            remaining = []
+            for connection, start, end, future in futures:
+                try:
+                    values[start:end] = future.result(self.timeout)
+                except FutureTimeoutError:
+                    connection.reset()
+                    remaining.append((start, end))
+                except ConnectionError:
+                    remaining.append((start, end))
+            if not remaining:
+                return values
+        raise ConnectionError(f'evaluations failed after {self.retries} retries')
+
+    def __call__(self, x):
+        x = np.asarray(x, dtype=FLOAT)
+        points = np.ascontiguousarray(x.reshape(-1, x.shape[-1]))
+        values = self.evaluate_points(points)
+        return values.reshape(x.shape[:-1]) if x.ndim > 1 else values[0]
+
+    def close(self):
+        for connection in self.connections:
+            connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __getstate__(self):
+        return {
+            'addresses': self.addresses, 'model': self.model, 'pipeline': self.pipeline,
+            'timeout': self.timeout, 'retries': self.retries,
+            'reconnect_delay': self.reconnect_delay, 'cache_key': self.cache_key
+        }
+
+    def __setstate__(self, state):
+        cache_key = state.pop('cache_key')
+        self.__init__(**state)
+        self.cache_key = cache_key
+
+
+class WorkerHandler(socketserver.StreamRequestHandler):
+    '''
+    Evaluate the batches of points of a connection with the objective
+    function of the server, until the connection is closed
+    '''
+
+    def handle(self):
+        while True:
+            header = self.rfile.read(REQUEST.size)
+            if len(header) < REQUEST.size:
+                return
+            request_id, n_points, n_vars = REQUEST.unpack(header)
+            size = n_points * n_vars * FLOAT.itemsize
+            data = self.rfile.read(size)
+            if len(data) < size:
+                return
+            points = np.frombuffer(data, FLOAT).reshape(n_points, n_vars)
+            try:
+                values = np.asarray(evaluate_batch(self.server.function, points), dtype=FLOAT)
+                response = RESPONSE.pack(request_id, values.size) + values.tobytes()
+            except Exception as error:
+                message = repr(error).encode()
+                response = RESPONSE.pack(request_id, -len(message)) + message
+            self.wfile.write(response)
+
+
+class UnixWorkerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class TCPWorkerServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def serve(function, address):
+    '''
+    Serve the objective function at the given address, one thread
+    per connection, until interrupted
+    '''
+    address = parse_address(address)
+    server_class = TCPWorkerServer if isinstance(address, tuple) else UnixWorkerServer
+    if not isinstance(address, tuple) and os.path.exists(address):
+        os.unlink(address)
+    with server_class(address, WorkerHandler) as server:
+        server.function = function
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if not isinstance(address, tuple):
+                os.unlink(address)
+
+
+def wait_for_worker(address, timeout=10):
+    '''
+    Wait until a worker accepts connections at the given address
+    '''
+    address = parse_address(address)
+    deadline = time.monotonic() + timeout
+    while True:
+        with socket.socket(socket_family(address), socket.SOCK_STREAM) as sock:
+            try:
+                sock.connect(address)
+                return
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+        time.sleep(0.05)
+
+
+class LocalWorkers:
+    '''
+    Stand-in workers serving a benchmark function over Unix sockets,
+    each in its own process, for testing remote objectives
+    '''
+
+    def __init__(self, n_workers, function='rosenbrock', backend='numpy'):
+        assert(n_workers > 0)
+        self.directory = tempfile.mkdtemp(prefix='sabc-workers-')
+        self.addresses = [
+            os.path.join(self.directory, f'worker{i}.sock') for i in range(n_workers)
+        ]
+        self.processes = [
+            subprocess.Popen([
+                sys.executable, os.path.abspath(__file__),
+                '-f', function, '--backend', backend, address
+            ])
+            for address in self.addresses
+        ]
+        try:
+            for address in self.addresses:
+                wait_for_worker(address)
+        except OSError:
+            self.close()
+            raise
+
+    def close(self):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.wait()
+        for address in self.addresses:
+            if os.path.exists(address):
+                os.unlink(address)
+        os.rmdir(self.directory)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def worker_cli_parser():
+    '''
+    Create a standard input arguments parser
+    '''
+    parser = argparse.ArgumentParser(
+        prog='remote', description='Stand-in worker serving a benchmark function'
+    )
+    parser.add_argument(
+        dest='address', action='store',
+        type=str, help='Unix socket path, or host:port TCP address, to serve at'
+    )
+    parser.add_argument(
+        '-f', '--function', action='store', default='rosenbrock',
+        type=str, choices=FUNCTIONS.keys(), help='benchmark function'
+    )
+    parser.add_argument(
+        '--backend', action='store', default='numpy',
+        type=str, choices=BACKENDS, help='implementation of the benchmark function'
+    )
+    return parser
+
+
+def main():
+    parser = worker_cli_parser()
+    args = parser.parse_args()
+    serve(backend_functions(args.backend)[args.function], args.address)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,35 +4,311 @@ Simplex Artificial Bee Colony algorithm
 
 
 import argparse
-import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
 import numpy as np
 
 import abeec
-from abeec import abc_cli_parser, abc_algorithm
-from amoeba import amoeba_cli_parser, simplex_coordinates, downhill_simplex
-from utils import ListAction, FUNCTIONS, print_statistics
+from abeec import abc_cli_parser, iter_abc
+from amoeba import (
+    amoeba_cli_parser, NelderMeadParams, simplex_coordinates, downhill_simplex, downhill_simplices
+)
+from cache import cli_cache
+from checkpoint import checkpoint_path
+from compiled import BACKENDS, backend_functions
+from evaluators import EVALUATORS
+from islands import TOPOLOGIES, island_algorithm
+from profiling import with_profile, write_profiles
+from streaming import drain, start_stream, stream_run
+from surrogate import cli_surrogate
+from termination import cli_budget
+from utils import (
+    ListAction, DTYPES, FUNCTIONS, evaluate_batch, print_statistics, run_repetitions
+)
 
 
-def renew_food_sources(food_sources, trails, limit, lower_bounds, upper_bounds, function, *args):
+def renew_food_sources(food_sources, values, fitnesses, trails, limit,
+                       lower_bounds, upper_bounds, function, nelder_mead=NelderMeadParams(),
+                       states=None, budget=None, rng=None):
     '''
-    Scout bees stage
+    Scout bees stage, refining all the exhausted food sources
+    with a single batched Nelder-Mead run (sharing the given budget)
     '''
     n_food_sources, n_vars = food_sources.shape
     assert(n_food_sources == trails.size)
 
-    for i, trail in enumerate(trails):
-        if trail >= limit:
-            simplex = simplex_coordinates(food_sources[i])
-            food_sources[i], _ = downhill_simplex(
-                simplex, function, *args
-            )
-            trails[i] = 0
-            if not np.array_equal(food_sources[i], abeec.find_best(food_sources, function)):
+    exhausted = np.flatnonzero(trails >= limit)
+    if exhausted.size == 0:
+        return food_sources, values, fitnesses
+
+    # The values of the food sources (the first vertices) are known
+    simplices = np.array([simplex_coordinates(food_sources[i]) for i in exhausted])
+    known = np.full(simplices.shape[:2], np.nan)
+    known[:, 0] = values[exhausted]
+    food_sources[exhausted], _, _, simplex_values = downhill_simplices(
+        simplices, function, *nelder_mead, budget=budget, dtype=food_sources.dtype,
+        values=known, full_output=True
+    )
+    values[exhausted] = np.min(simplex_values, axis=1)
+    merge_refined(
+        food_sources, values, fitnesses, trails, exhausted,
+        lower_bounds, upper_bounds, function, states, rng
+    )
+    return food_sources, values, fitnesses
+
+
+def merge_refined(food_sources, values, fitnesses, trails, refined,
+                  lower_bounds, upper_bounds, function, states=None, rng=None):
+    '''
+    Merge the given refined food sources (whose values are set) into the
+    colony: the ones not improving the best food source are renewed.
+    Return the indexes of the renewed food sources
+    '''
+    fitnesses[refined] = abeec.value_fitness(values[refined])
+    trails[refined] = 0
+
+    best_food_source = food_sources[np.argmax(fitnesses)]
+    renewed = np.array([
+        i for i in refined if not np.array_equal(food_sources[i], best_food_source)
+    ], dtype=int)
+    food_sources[renewed] = abeec.renew_food_source(
+        food_sources[renewed], lower_bounds, upper_bounds, rng
+    )
+    values[renewed] = evaluate_batch(function, food_sources[renewed])
+    fitnesses[renewed] = abeec.value_fitness(values[renewed])
+
+    if states is not None:
+        states[refined] = function.state(food_sources[refined])
+    return renewed
+
+
+class WarmScout:
+    '''
+    Scout bees stage refining all the exhausted food sources with a single
+    batched Nelder-Mead run (see renew_food_sources), warm-started from
+    the local search state kept for each food source.
+    The simplex the last refinement of a food source converged to (along with
+    its vertex values) is reused while the food source stays within one step
+    of its best vertex, with the food source replacing its worst vertex,
+    so that no vertex is evaluated again. Otherwise, the new simplex steps
+    by step_scale times the spread (standard deviation) of the colony
+    along each dimension, towards the inside of the bounds, and only
+    its n new vertices are evaluated
+    '''
+
+    def __init__(self, step_scale=0.1):
+        assert(step_scale > 0)
+        self.step_scale = step_scale
+        self.simplices = {}
+
+    def initial_simplex(self, i, food_source, value, step, upper_bounds):
+        '''
+        Return the initial simplex of the refinement of a food source
+        and its known vertex values (NaN for the ones to evaluate)
+        '''
+        if i in self.simplices:
+            simplex, simplex_values = self.simplices[i]
+            best = np.argmin(simplex_values)
+            if np.all(np.abs(food_source - simplex[best]) <= step):
+                simplex, simplex_values = simplex.copy(), simplex_values.copy()
+                if not np.array_equal(food_source, simplex[best]):
+                    worst = np.argmax(simplex_values)
+                    simplex[worst] = food_source
+                    simplex_values[worst] = value
+                return simplex, simplex_values
+        simplex = simplex_coordinates(
+            food_source, np.where(food_source + step > upper_bounds, -step, step)
+        )
+        simplex_values = np.full(len(simplex), np.nan)
+        simplex_values[0] = value
+        return simplex, simplex_values
+
+    def __call__(self, food_sources, values, fitnesses, trails, limit,
+                 lower_bounds, upper_bounds, function, nelder_mead=NelderMeadParams(),
+                 states=None, budget=None, rng=None):
+        n_food_sources, n_vars = food_sources.shape
+        assert(n_food_sources == trails.size)
+
+        exhausted = np.flatnonzero(trails >= limit)
+        if exhausted.size == 0:
+            return food_sources, values, fitnesses
+
+        # Steps are kept off zero once the colony has collapsed
+        step = np.maximum(
+            self.step_scale * np.std(food_sources, axis=0), 1e-8 * (upper_bounds - lower_bounds)
+        )
+        initial = [
+            self.initial_simplex(i, food_sources[i], values[i], step, upper_bounds)
+            for i in exhausted
+        ]
+        food_sources[exhausted], _, simplices, simplex_values = downhill_simplices(
+            np.array([simplex for simplex, _ in initial]), function, *nelder_mead,
+            budget=budget, dtype=food_sources.dtype,
+            values=np.array([known for _, known in initial]), full_output=True
+        )
+        values[exhausted] = np.min(simplex_values, axis=1)
+        for k, i in enumerate(exhausted):
+            self.simplices[i] = simplices[k], simplex_values[k]
+        renewed = merge_refined(
+            food_sources, values, fitnesses, trails, exhausted,
+            lower_bounds, upper_bounds, function, states, rng
+        )
+        for i in renewed:
+            del self.simplices[i]
+        return food_sources, values, fitnesses
+
+    def state(self):
+        '''
+        Return the kept simplices and their vertex values
+        as checkpoint entries (see checkpoint.save_checkpoint)
+        '''
+        if not self.simplices:
+            return {}
+        indexes = sorted(self.simplices)
+        return {
+            'warm_indexes': np.array(indexes),
+            'warm_simplices': np.array([self.simplices[i][0] for i in indexes]),
+            'warm_values': np.array([self.simplices[i][1] for i in indexes])
+        }
+
+    def restore(self, colony):
+        '''
+        Restore the kept simplices from the entries of a loaded checkpoint
+        '''
+        if 'warm_indexes' in colony:
+            self.simplices = {
+                i: (simplex, simplex_values) for i, simplex, simplex_values in zip(
+                    colony['warm_indexes'], colony['warm_simplices'], colony['warm_values']
+                )
+            }
+
+
+def refine_food_source(food_source, function, nelder_mead=NelderMeadParams(), budget=None,
+                       value=np.nan, stop=None):
+    '''
+    Refine a food source of the given value (if known) with a Nelder-Mead run
+    (sharing the given budget), returning the refined food source and its value.
+    If given, the stop event ends the run at its next iteration
+    '''
+    if stop is not None and stop.is_set():
+        return food_source, value
+    simplex = simplex_coordinates(food_source)
+    known = np.full(len(simplex), np.nan)
+    known[0] = value
+    food_source, _, _, simplex_values = downhill_simplex(
+        simplex, function, *nelder_mead, budget=budget, dtype=food_source.dtype,
+        values=known, full_output=True,
+        callback=None if stop is None else lambda statistics: stop.is_set()
+    )
+    return food_source, simplex_values[0]
+
+
+class AsyncScout:
+    '''
+    Asynchronous scout bees stage: the exhausted food sources are refined
+    by Nelder-Mead runs in a background pool of threads while the colony
+    keeps evolving, and they are merged back as soon as their runs complete:
+    a refined food source replaces the current one only if it improves it
+    (the bees keep moving it meanwhile), and the result is kept if it is
+    the best food source, and renewed otherwise.
+    Since merges depend on the completion times of the runs,
+    results are not reproducible
+    '''
+
+    def __init__(self, workers=None):
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.pending = {}
+        self.stop = threading.Event()
+
+    def __call__(self, food_sources, values, fitnesses, trails, limit,
+                 lower_bounds, upper_bounds, function, nelder_mead=NelderMeadParams(),
+                 states=None, budget=None, rng=None):
+        n_food_sources, n_vars = food_sources.shape
+        assert(n_food_sources == trails.size)
+
+        # Merge the completed refinements
+        for i, future in list(self.pending.items()):
+            if not future.done():
+                continue
+            del self.pending[i]
+            food_source, value = future.result()
+            if abeec.is_fit_better(fitnesses[i], abeec.value_fitness(value)):
+                food_sources[i], values[i] = food_source, value
+                fitnesses[i] = abeec.value_fitness(value)
+            if not np.array_equal(food_sources[i], food_sources[np.argmax(fitnesses)]):
                 food_sources[i] = abeec.renew_food_source(
-                    food_sources[i], lower_bounds, upper_bounds
+                    food_sources[i], lower_bounds, upper_bounds, rng
                 )
-    return food_sources
+                values[i] = function(food_sources[i])
+                fitnesses[i] = abeec.value_fitness(values[i])
+            if states is not None:
+                states[i] = function.state(food_sources[i])
+
+        # Hand the exhausted food sources over to the background runs
+        for i in np.flatnonzero(trails >= limit):
+            if i not in self.pending:
+                self.pending[i] = self.executor.submit(
+                    refine_food_source, np.array(food_sources[i], copy=True), function,
+                    nelder_mead, budget, values[i], self.stop
+                )
+            trails[i] = 0
+        return food_sources, values, fitnesses
+
+    def close(self):
+        '''
+        Discard the pending refinements, stopping the running ones
+        at their next iteration and waiting for them
+        '''
+        self.stop.set()
+        for future in self.pending.values():
+            future.cancel()
+        self.pending = {}
+        self.executor.shutdown()
+
+
+def iter_sabc(n_food_sources, lower_bounds, upper_bounds, limit,
+              abc_stop, abc_iterations, function, *nelder_mead, scout_workers=0,
+              warm_start=False, **kwargs):
+    '''
+    Iterations of the main SABC algorithm: the ABC algorithm with
+    a Nelder-Mead based scout bees stage (see abeec.iter_abc).
+    The Nelder-Mead parameters are given either as a NelderMeadParams
+    or as its fields (nm_iterations, tol, alpha, beta, gamma).
+    If scout_workers is given, the scout bees stage runs asynchronously
+    over that many background threads (see AsyncScout).
+    If warm_start is set, the Nelder-Mead runs are warm-started from the
+    local search state of each food source (see WarmScout).
+    The scout bees stage is given to iter_abc, so SABC and ABC runs
+    can share a process (or run concurrently in threads)
+    '''
+    if len(nelder_mead) == 1 and isinstance(nelder_mead[0], NelderMeadParams):
+        nelder_mead = nelder_mead[0]
+    else:
+        nelder_mead = NelderMeadParams(*nelder_mead)
+    assert(not (warm_start and scout_workers))
+    scout = AsyncScout(scout_workers) if scout_workers else renew_food_sources
+    if warm_start:
+        scout = WarmScout()
+    try:
+        return (yield from iter_abc(
+            n_food_sources, lower_bounds, upper_bounds, limit, abc_stop, abc_iterations,
+            function, nelder_mead, scout=scout, **kwargs
+        ))
+    finally:
+        if scout_workers:
+            scout.close()
+
+
+def sabc_algorithm(*args, **kwargs):
+    '''
+    Main SABC algorithm, running all the iterations of iter_sabc
+    with the given arguments.
+    Return the best food source, the number of iterations
+    and the number of objective function evaluations
+    '''
+    return drain(iter_sabc(*args, **kwargs))
 
 
 def sabc_cli_parser():
@@ -68,6 +344,18 @@ def sabc_cli_parser():
         '-c', '--abc_stop', action='store', default=100,
         type=int, help='maximum number of non-changing best value before stopping'
     ),
+    abc_group.add_argument(
+        '-s', '--synchronous', action='store_true',
+        help='move the whole colony at once in the employed/onlooker bees stages'
+    )
+    parser.add_argument(
+        '-e', '--evaluator', action='store', default='serial',
+        type=str, choices=EVALUATORS.keys(), help='objective function evaluator'
+    )
+    parser.add_argument(
+        '--evaluator_workers', action='store', default=None,
+        type=int, help='number of workers of the objective function evaluator'
+    )
     amoeba_group.add_argument(
         '--nm_iterations', action='store', default=1000,
         type=int, help='maximum number of iterations'
@@ -88,35 +376,173 @@ def sabc_cli_parser():
         '-g', '--gamma', action='store', default=2,
         type=float, help='coefficient for expansion'
     )
+    amoeba_group.add_argument(
+        '--scout_workers', action='store', default=0,
+        type=int, help='number of background threads for asynchronous Nelder-Mead runs'
+    )
+    amoeba_group.add_argument(
+        '--warm_start', action='store_true',
+        help='warm-start the Nelder-Mead runs from the local search state of each food source'
+    )
     parser.add_argument(
         '-f', '--function', action='store', default='rosenbrock',
         type=str, choices=FUNCTIONS.keys(), help='benchmark function'
     )
+    parser.add_argument(
+        '--backend', action='store', default='numpy',
+        type=str, choices=BACKENDS, help='implementation of the benchmark function and kernels'
+    )
+    parser.add_argument(
+        '--dtype', action='store', default='float64',
+        type=str, choices=DTYPES.keys(), help='floating point type of the food sources'
+    )
     parser.add_argument(
         '-r', '--runtimes', action='store', default=1,
         type=int, help='number of executions'
     )
+    parser.add_argument(
+        '--cache_size', action='store', default=None,
+        type=int, help='size of the in-memory objective function evaluations cache'
+    )
+    parser.add_argument(
+        '--cache_file', action='store', default=None,
+        type=str, help='SQLite file persisting the objective function evaluations cache'
+    )
+    parser.add_argument(
+        '--checkpoint', action='store', default=None,
+        type=str, help='file where the colony state is periodically saved'
+    )
+    parser.add_argument(
+        '--checkpoint_every', action='store', default=100,
+        type=int, help='number of iterations between checkpoints'
+    )
+    parser.add_argument(
+        '--resume', action='store_true',
+        help='resume the executions from their checkpoints, if any'
+    )
+    abc_group.add_argument(
+        '--islands', action='store', default=1,
+        type=int, help='number of colonies, each running in its own process'
+    )
+    abc_group.add_argument(
+        '--migration_every', action='store', default=10,
+        type=int, help='number of iterations between migrations of the best food sources'
+    )
+    abc_group.add_argument(
+        '--topology', action='store', default='ring',
+        type=str, choices=TOPOLOGIES, help='migration topology of the colonies'
+    )
+    abc_group.add_argument(
+        '--surrogate', action='store', default=None,
+        type=float, help='fraction of the bees candidates evaluated, as ranked by a surrogate'
+    )
+    abc_group.add_argument(
+        '--surrogate_archive', action='store', default=200,
+        type=int, help='number of recent evaluations the surrogate is fitted on'
+    )
+    parser.add_argument(
+        '--max_time', action='store', default=None,
+        type=float, help='maximum wall-clock seconds of each execution'
+    )
+    parser.add_argument(
+        '--max_evaluations', action='store', default=None,
+        type=int, help='maximum number of objective function evaluations of each execution'
+    )
+    parser.add_argument(
+        '--target', action='store', default=None,
+        type=float, help='objective value stopping the executions once reached'
+    )
+    parser.add_argument(
+        '--stall_iterations', action='store', default=None,
+        type=int, help='number of iterations without relative improvement before stopping'
+    )
+    parser.add_argument(
+        '--stall_tol', action='store', default=1e-8,
+        type=float, help='relative improvement of the best value counting as a stall'
+    )
+    parser.add_argument(
+        '--profile', action='store', default=None, nargs='?', const='-',
+        type=str, help='print the per-stage profile, or export it as JSON to the given file'
+    )
+    parser.add_argument(
+        '--stream', action='store', default=None, nargs='?', const='-',
+        type=str, help='write a JSON line per iteration to stdout, or to the given file'
+    )
+    parser.add_argument(
+        '-w', '--workers', action='store', default=1,
+        type=int, help='number of worker processes for the executions'
+    )
+    parser.add_argument(
+        '--seed', action='store', default=None,
+        type=int, help='seed of the random streams of the executions'
+    )
     return parser
 
 
 def main():
     parser = sabc_cli_parser()
     args = parser.parse_args()
-    abeec.renew_food_sources = renew_food_sources
+    if args.islands > 1 and args.profile is not None:
+        parser.error('profiling is not supported with multiple islands')
+    if args.islands > 1 and args.stream is not None:
+        parser.error('streaming is not supported with multiple islands')
+    if args.warm_start and args.scout_workers:
+        parser.error('warm starts are not supported with asynchronous Nelder-Mead runs')
+    algorithm = sabc_algorithm if args.stream is None else iter_sabc
+    if args.islands > 1:
+        algorithm = partial(
+            island_algorithm, sabc_algorithm, args.islands,
+            migration_every=args.migration_every, topology=args.topology
+        )
+    cache = cli_cache(args.cache_size, args.cache_file)
+    surrogates = [
+        cli_surrogate(args.surrogate, args.surrogate_archive) for _ in range(args.runtimes)
+    ]
+    with EVALUATORS[args.evaluator](args.evaluator_workers) as evaluator:
+        runs = [
+            partial(
+                algorithm,
+                args.n_food_sources, args.lower_bounds, args.upper_bounds,
+                args.limit, args.abc_stop, args.abc_iterations,
+                backend_functions(args.backend)[args.function],
+                NelderMeadParams(args.nm_iterations, args.tol, args.alpha, args.beta, args.gamma),
+                synchronous=args.synchronous,
+                # Left out when serial, keeping the incremental bee moves
+                evaluator=None if args.evaluator == 'serial' else evaluator,
+                cache=cache,
+                scout_workers=args.scout_workers,
+                warm_start=args.warm_start,
+                checkpoint=checkpoint_path(args.checkpoint, run, args.runtimes),
+                checkpoint_every=args.checkpoint_every,
+                resume=args.resume,
+                budget=cli_budget(
+                    args.max_time, args.max_evaluations, args.target,
+                    args.stall_iterations, args.stall_tol
+                ),
+                surrogate=surrogate,
+                dtype=DTYPES[args.dtype]
+            )
+            for run, surrogate in enumerate(surrogates)
+        ]
+        if args.stream is not None:
+            start_stream(args.stream)
+            runs = [partial(stream_run, run, args.stream, i) for i, run in enumerate(runs)]
+        if args.profile is not None:
+            runs = [partial(with_profile, run) for run in runs]
+        runs = run_repetitions(runs, args.workers, args.seed)
+    if args.profile is not None:
+        profiles = [profile for (_, profile), _ in runs]
+        runs = [(result, run_time) for (result, _), run_time in runs]
     results = []
     mins = []
     iterations = []
+    evaluations = []
     times = []
-    for _ in range(args.runtimes):
-        start_time = time.time()
-        result, n_iteration = abc_algorithm(
-            args.n_food_sources, args.lower_bounds, args.upper_bounds,
-            args.limit, args.abc_stop, args.abc_iterations, FUNCTIONS[args.function],
-            args.nm_iterations, args.tol, args.alpha, args.beta, args.gamma
-        )
-        times.append(time.time() - start_time)
+    for (result, n_iteration, n_evaluation), run_time in runs:
+        times.append(run_time)
         results.append(result)
         iterations.append(n_iteration)
+        evaluations.append(n_evaluation)
         mins.append(FUNCTIONS[args.function](result))
 
     # Print results
@@ -124,11 +550,23 @@ def main():
         print(f'Result: {results[0]}')
         print(f'Minimum: {mins[0]}')
         print(f'Iterations: {iterations[0]}/{args.abc_iterations}')
+        print(f'Evaluations: {evaluations[0]}')
         print(f'Execution time: {times[0]} seconds')
     else:
-        print_statistics(results, mins, iterations, args.abc_iterations, FUNCTIONS[args.function])
+        print_statistics(
+            results, mins, iterations, args.abc_iterations,
+            FUNCTIONS[args.function], evaluations
+        )
         print(f'Mean execution time: {np.mean(times)} seconds')
         print(f'Total execution time: {np.sum(times)} seconds')
+    if args.surrogate is not None and args.workers == 1 and args.islands == 1:
+        print(f'Surrogate saved evaluations: {sum(surrogate.saved for surrogate in surrogates)}')
+    if args.profile is not None:
+        write_profiles(profiles, args.profile)
+    if cache is not None:
+        if args.workers == 1:
+            print(f'Cache: {cache.stats()}')
+        cache.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,66 @@
+'''
+Streaming of the iterations of the algorithms
+'''
+
+
+import json
+import sys
+from contextlib import nullcontext
+from typing import NamedTuple
+
+import numpy as np
+
+
+class Snapshot(NamedTuple):
+    '''
+    State of an algorithm run after an iteration: only its best point
+    (a copy, never modified by the run), best value and evaluations count
+    '''
+    iteration: int
+    best_point: np.ndarray
+    best_value: float
+    evaluations: int
+
+    def to_dict(self):
+        '''
+        Return the snapshot as a JSON serializable dictionary
+        '''
+        return dict(self._asdict(), best_point=self.best_point.tolist())
+
+
+def drain(iterator):
+    '''
+    Exhaust the iterations of an algorithm run, returning its result
+    '''
+    while True:
+        try:
+            next(iterator)
+        except StopIteration as stop:
+            return stop.value
+
+
+def start_stream(path='-'):
+    '''
+    Truncate the JSONL file the runs will stream to (if it is not stdout)
+    '''
+    if path != '-':
+        open(path, 'w').close()
+
+
+def stream_run(iterate, path='-', run=None, **kwargs):
+    '''
+    Execute the iterations of an algorithm run (with the given keyword
+    arguments), appending each snapshot as a JSON line, tagged with the
+    given run index, to the given file or to stdout.
+    Return the result of the run
+    '''
+    iterator = iterate(**kwargs)
+    with nullcontext(sys.stdout) if path == '-' else open(path, 'a') as f:
+        while True:
+            try:
+                snapshot = next(iterator)
+            except StopIteration as stop:
+                return stop.value
+            # A single write per line, so that the lines of concurrent runs do not interleave
+            f.write(json.dumps(dict(snapshot.to_dict(), run=run)) + '\n')
+            f.flush()
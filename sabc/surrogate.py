@@ -0,0 +1,167 @@
+'''
+Surrogate-assisted pre-screening of candidate points
+'''
+
+
+import math
+
+import numpy as np
+
+
+def cli_surrogate(fraction=None, archive_size=200):
+    '''
+    Return the surrogate described by the CLI arguments,
+    or None if its fraction is not given
+    '''
+    if fraction is None:
+        return None
+    return RBFSurrogate(fraction, archive_size)
+
+
+# Attributes of a surrogate saved in the checkpoints of the colony
+STATE = ('points', 'values', 'stale', 'centers', 'weights', 'tail', 'screened', 'saved')
+
+
+def distances(a, b):
+    '''
+    Compute the euclidean distances between the rows of two matrices
+    '''
+    return np.sqrt(np.maximum(np.sum((a[:, np.newaxis] - b[np.newaxis]) ** 2, axis=-1), 0))
+
+
+class RBFSurrogate:
+    '''
+    Cubic radial basis function interpolator with a linear tail, fitted on
+    an archive of the archive_size most recently evaluated points.
+    It pre-screens batches of candidates, letting only the given fraction
+    with the largest predicted improvements go to the objective function,
+    and single trial points, letting only the ones predicted to improve
+    a given value go to it. The skipped evaluations are counted in saved.
+    Until the archive holds 2 * (n_vars + 1) points, every candidate goes
+    to the objective function
+    '''
+
+    def __init__(self, fraction=0.5, archive_size=200, refit_every=1):
+        assert(0 < fraction <= 1)
+        assert(archive_size > 0)
+        assert(refit_every > 0)
+        self.fraction = fraction
+        self.archive_size = archive_size
+        self.refit_every = refit_every
+        self.points = None
+        self.values = None
+        self.stale = 0
+        self.centers = None
+        self.screened = 0
+        self.saved = 0
+
+    def add(self, points, values):
+        '''
+        Archive evaluated points (a single one, or a matrix of them) and their values
+        '''
+        points = np.atleast_2d(np.asarray(points, dtype=float))
+        values = np.atleast_1d(np.asarray(values, dtype=float))
+        if len(points) == 0:
+            return
+        if self.points is None:
+            self.points = points[-self.archive_size:].copy()
+            self.values = values[-self.archive_size:].copy()
+        else:
+            self.points = np.concatenate((self.points, points))[-self.archive_size:]
+            self.values = np.concatenate((self.values, values))[-self.archive_size:]
+        self.stale += len(points)
+
+    def ready(self):
+        '''
+        Check if the archive holds enough points to fit the interpolator
+        '''
+        return self.points is not None and len(self.points) >= 2 * (self.points.shape[1] + 1)
+
+    def fit(self):
+        '''
+        Fit the interpolator on the archive
+        '''
+        m, n_vars = self.points.shape
+        tail = np.hstack((np.ones((m, 1)), self.points))
+        system = np.zeros((m + n_vars + 1, m + n_vars + 1))
+        system[:m, :m] = distances(self.points, self.points) ** 3
+        system[:m, m:] = tail
+        system[m:, :m] = tail.T
+        rhs = np.concatenate((self.values, np.zeros(n_vars + 1)))
+        try:
+            coefficients = np.linalg.solve(system, rhs)
+        except np.linalg.LinAlgError:
+            coefficients = np.linalg.lstsq(system, rhs, rcond=None)[0]
+        if not np.all(np.isfinite(coefficients)):
+            coefficients = np.linalg.lstsq(system, rhs, rcond=None)[0]
+        self.centers = self.points.copy()
+        self.weights = coefficients[:m]
+        self.tail = coefficients[m:]
+        self.stale = 0
+
+    def predict(self, points):
+        '''
+        Predict the values of a matrix of points, refitting the interpolator
+        if enough points were archived since the last fit
+        '''
+        if self.centers is None or self.stale >= self.refit_every:
+            self.fit()
+        points = np.atleast_2d(points)
+        return (
+            (distances(points, self.centers) ** 3) @ self.weights +
+            self.tail[0] + points @ self.tail[1:]
+        )
+
+    def screen(self, candidates, values):
+        '''
+        Return the mask of the candidates worth a true evaluation:
+        the fraction of them with the largest predicted improvements
+        over the given values (the ones of the points they would replace)
+        '''
+        n_candidates = len(candidates)
+        if n_candidates == 0 or not self.ready():
+            return np.ones(n_candidates, dtype=bool)
+        improvements = values - self.predict(candidates)
+        selected = math.ceil(self.fraction * n_candidates)
+        mask = np.zeros(n_candidates, dtype=bool)
+        mask[np.argsort(-improvements, kind='stable')[:selected]] = True
+        self.screened += n_candidates
+        self.saved += n_candidates - selected
+        return mask
+
+    def improves(self, point, value):
+        '''
+        Check if a trial point is predicted to improve the given value
+        (or if it cannot be predicted yet)
+        '''
+        if not self.ready():
+            return True
+        self.screened += 1
+        if self.predict(point)[0] < value:
+            return True
+        self.saved += 1
+        return False
+
+    def state(self):
+        '''
+        Return the archive, interpolator and statistics of the surrogate
+        as checkpoint entries (see checkpoint.save_checkpoint)
+        '''
+        return {f'surrogate_{key}': getattr(self, key, None) for key in STATE}
+
+    def restore(self, colony):
+        '''
+        Restore the state of the surrogate from the entries of a loaded checkpoint
+        '''
+        for key in STATE:
+            setattr(self, key, colony.get(f'surrogate_{key}', getattr(self, key, None)))
+
+    def stats(self):
+        '''
+        Return the screening statistics of the surrogate
+        '''
+        return {
+            'screened': self.screened,
+            'saved': self.saved,
+            'archive': 0 if self.points is None else len(self.points)
+        }
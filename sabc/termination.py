@@ -0,0 +1,143 @@
+'''
+Budget-driven termination of the algorithms
+'''
+
+
+import threading
+import time
+
+import numpy as np
+
+
+def cli_budget(max_time=None, max_evaluations=None, target=None,
+               stall_iterations=None, stall_tol=1e-8):
+    '''
+    Return the budget described by the CLI arguments,
+    or None if none of its criteria are given
+    '''
+    criteria = (max_time, max_evaluations, target, stall_iterations)
+    if all(criterion is None for criterion in criteria):
+        return None
+    return Budget(max_time, max_evaluations, target, stall_iterations, stall_tol)
+
+
+class Budget:
+    '''
+    Termination criteria shared by an algorithm run and its nested runs
+    (such as the Nelder-Mead runs of the SABC scout bees stage):
+    maximum wall-clock time in seconds, maximum number of objective
+    function evaluations, target objective value and stall detection,
+    stopping after stall_iterations iterations whose relative improvement
+    of the best value is below stall_tol.
+    The run that starts the budget owns it: nested runs only check its
+    time, evaluations and target, and leave stall detection to the owner.
+    A budget serves a single run: once finished, it cannot be started again,
+    so that leftover nested runs (such as background Nelder-Mead runs)
+    never take it over.
+    The reason of the last stop is kept in reason
+    '''
+
+    def __init__(self, max_time=None, max_evaluations=None, target=None,
+                 stall_iterations=None, stall_tol=1e-8):
+        assert(max_time is None or max_time > 0)
+        assert(max_evaluations is None or max_evaluations > 0)
+        assert(stall_iterations is None or stall_iterations > 0)
+        assert(stall_tol >= 0)
+        self.max_time = max_time
+        self.max_evaluations = max_evaluations
+        self.target = target
+        self.stall_iterations = stall_iterations
+        self.stall_tol = stall_tol
+        self.function = None
+        self.reason = None
+        self.started = False
+        self.lock = threading.Lock()
+
+    def start(self, function):
+        '''
+        Start the budget, counting the evaluations of the given CountedFunction.
+        Return whether the caller owns it, i.e. whether it was never started
+        '''
+        with self.lock:
+            if self.started:
+                return False
+            self.started = True
+            self.function = function
+            self.start_time = time.perf_counter()
+            self.best = np.inf
+            self.stalled = 0
+            self.reason = None
+            return True
+
+    def finish(self):
+        '''
+        Finish the budget, stopping any leftover nested run
+        '''
+        with self.lock:
+            self.function = None
+
+    def state(self):
+        '''
+        Return the stall detection state of the budget
+        as checkpoint entries (see checkpoint.save_checkpoint)
+        '''
+        return {'budget_best': self.best, 'budget_stalled': self.stalled}
+
+    def restore(self, colony):
+        '''
+        Restore the stall detection state of the budget from the entries
+        of a loaded checkpoint
+        '''
+        self.best = colony.get('budget_best', self.best)
+        self.stalled = colony.get('budget_stalled', self.stalled)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def elapsed(self):
+        '''
+        Return the seconds elapsed since the budget was started
+        '''
+        return time.perf_counter() - self.start_time
+
+    def exhausted(self, value=None):
+        '''
+        Check the time, evaluations and target criteria,
+        given the current best value
+        (a finished budget is exhausted, stopping any leftover nested run)
+        '''
+        function = self.function
+        if function is None:
+            return True
+        if self.max_time is not None and self.elapsed() >= self.max_time:
+            self.reason = 'time'
+        elif (self.max_evaluations is not None and
+                function.evaluations >= self.max_evaluations):
+            self.reason = 'evaluations'
+        elif self.target is not None and value is not None and value <= self.target:
+            self.reason = 'target'
+        return self.reason is not None
+
+    def stop(self, value):
+        '''
+        Check all the criteria, given the best value of the current iteration
+        '''
+        if self.exhausted(value):
+            return True
+        if self.stall_iterations is None:
+            return False
+        if np.isfinite(self.best) and (
+                self.best - value <= self.stall_tol * max(abs(self.best), np.finfo(float).tiny)):
+            self.stalled += 1
+        else:
+            self.stalled = 0
+        self.best = min(self.best, value)
+        if self.stalled >= self.stall_iterations:
+            self.reason = 'stall'
+        return self.reason is not None
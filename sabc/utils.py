@@ -4,18 +4,195 @@ Utility functions
 
 
 import argparse
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
 
 import numpy as np
 
 
+def parse_list(values):
+    '''
+    Parse a list of numbers given as a comma-separated string
+    (optionally enclosed in brackets)
+    '''
+    return [float(x)
+            for x in values.replace('[', '').replace(']', '').split(',')]
+
+
 class ListAction(argparse.Action):
     def __call__(self, parser, namespace, values, option_string=None):
-        values = [float(x)
-                  for x in values.replace('[', '').replace(']', '').split(',')]
-        setattr(namespace, self.dest, values)
+        setattr(namespace, self.dest, parse_list(values))
+
+
+def batched(function):
+    '''
+    Mark an objective function as able to evaluate a whole
+    (n_points, n_vars) matrix at once, returning n_points values
+    '''
+    function.batched = True
+    return function
+
+
+def is_batched(function):
+    '''
+    Check if the given objective function follows the batch contract
+    '''
+    return getattr(function, 'batched', False)
+
+
+def evaluate_batch(function, points):
+    '''
+    Evaluate a (n_points, n_vars) matrix of points, with a single call
+    for batched functions or one call per point otherwise
+    '''
+    if is_batched(function):
+        return np.asarray(function(points), dtype=float)
+    return np.array([function(point) for point in points], dtype=float)
+
+
+def incremental(state, delta):
+    '''
+    Mark an objective function as able to update its value in O(1)
+    when a single coordinate of a point changes.
+    state(x) computes the cached partial terms of a point (or of each row
+    of a matrix of points), while delta(x, state, d, x_d) returns the value
+    and the new state of x with its coordinate d set to x_d (for a single
+    point, or with one coordinate d and value x_d for each row).
+    The ABC bees moves of incremental functions are updated in O(1)
+    (see abeec.evaluate_move)
+    '''
+    def decorator(function):
+        function.state = state
+        function.delta = delta
+        return function
+    return decorator
+
+
+def is_incremental(function):
+    '''
+    Check if the given objective function follows the incremental contract
+    '''
+    return hasattr(function, 'state') and hasattr(function, 'delta')
+
+
+def coordinate(x, d):
+    '''
+    Return x[d] for a single point, or x[i, d[i]] for each row i of a matrix
+    '''
+    if np.ndim(x) == 1:
+        return x[d]
+    return x[np.arange(len(x)), d]
 
 
-def print_statistics(results, mins, iterations, max_iterations, function):
+def pair_delta(term, x, d, x_d):
+    '''
+    Compute the change of the sum of term(x[i], x[i + 1]) over
+    the adjacent pairs of x when its coordinate d is set to x_d
+    '''
+    n_vars = np.shape(x)[-1]
+    if np.ndim(x) == 1:
+        delta = 0
+        if d > 0:
+            delta += term(x[d - 1], x_d) - term(x[d - 1], x[d])
+        if d < n_vars - 1:
+            delta += term(x_d, x[d + 1]) - term(x[d], x[d + 1])
+        return delta
+
+    old = coordinate(x, d)
+    prev = coordinate(x, np.maximum(d - 1, 0))
+    succ = coordinate(x, np.minimum(d + 1, n_vars - 1))
+    return (
+        np.where(d > 0, term(prev, x_d) - term(prev, old), 0) +
+        np.where(d < n_vars - 1, term(x_d, succ) - term(old, succ), 0)
+    )
+
+
+class CountedFunction:
+    '''
+    Wrap an objective function and count its evaluations
+    (also when called from multiple threads).
+    If an evaluator is given (see evaluators.py), batches of points
+    are evaluated through it.
+    If a cache is given (see cache.py), points are looked up in it first,
+    and only the actual objective function evaluations are counted.
+    The incremental contract of the function is only exposed without
+    evaluator nor cache, so that all the evaluations go through them
+    '''
+
+    def __init__(self, function, evaluator=None, cache=None):
+        self.function = function
+        self.evaluator = evaluator
+        self.cache = cache
+        self.batched = evaluator is not None or cache is not None or is_batched(function)
+        self.evaluations = 0
+        self.lock = threading.Lock()
+        if is_incremental(function) and evaluator is None and cache is None:
+            self.state = function.state
+            self.delta = self.counted_delta
+
+    def count(self, n):
+        with self.lock:
+            self.evaluations += n
+
+    def __call__(self, x):
+        if self.cache is None:
+            return self.evaluate(x)
+        if np.ndim(x) < 2:
+            return self.cache.evaluate(self.function, [x], self.evaluate)[0]
+        return self.cache.evaluate(self.function, x, self.evaluate)
+
+    def evaluate(self, x):
+        if np.ndim(x) < 2:
+            self.count(1)
+            return self.function(x)
+        self.count(len(x))
+        if self.evaluator is not None:
+            return self.evaluator.evaluate(self.function, x)
+        return evaluate_batch(self.function, x)
+
+    def counted_delta(self, x, state, d, x_d):
+        self.count(np.size(x_d))
+        return self.function.delta(x, state, d, x_d)
+
+
+# Resources unpickled in worker processes (such as evaluator pools),
+# closed at the end of the run that received them (see seeded_run)
+SHIPPED = []
+
+
+def seeded_run(run, seed):
+    '''
+    Execute the given function with a random generator (its rng argument)
+    seeded from the given seed sequence, returning its result and execution time.
+    The resources shipped along with the function are closed afterwards
+    '''
+    rng = np.random.default_rng(seed)
+    start_time = time.time()
+    try:
+        result = run(rng=rng)
+    finally:
+        while SHIPPED:
+            SHIPPED.pop().close()
+    return result, time.time() - start_time
+
+
+def run_repetitions(runs, workers=1, seed=None):
+    '''
+    Execute the given functions over a pool of worker processes.
+    Each execution gets its own independent random stream spawned from
+    the given seed, so results do not depend on the number of workers
+    '''
+    assert(len(runs) > 0)
+    assert(workers > 0)
+    seeds = np.random.SeedSequence(seed).spawn(len(runs))
+    if workers == 1:
+        return [seeded_run(run, s) for run, s in zip(runs, seeds)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(seeded_run, runs, seeds))
+
+
+def print_statistics(results, mins, iterations, max_iterations, function, evaluations=None):
     '''
     Print some statistics related to multiple runtimes
     of the implemented algorithms
@@ -26,75 +203,186 @@ def print_statistics(results, mins, iterations, max_iterations, function):
     print(f'\tResult: {results[best_solution]}')
     print(f'\tMinimum: {mins[best_solution]}')
     print(f'\tIterations: {iterations[best_solution]}/{max_iterations}')
+    if evaluations is not None:
+        print(f'\tEvaluations: {evaluations[best_solution]}')
 
     print('Worst solution:')
     print(f'\tResult: {results[worst_solution]}')
     print(f'\tMinimum: {mins[worst_solution]}')
     print(f'\tIterations: {iterations[worst_solution]}/{max_iterations}')
+    if evaluations is not None:
+        print(f'\tEvaluations: {evaluations[worst_solution]}')
 
     mean_solution = np.mean(results, axis=0)
     print('Statistics:')
     print(f'\tMean result: {mean_solution}')
     print(f'\tMean minimum: {np.mean(mins)}')
     print(f'\tMean iterations: {np.mean(iterations)}/{max_iterations}')
+    if evaluations is not None:
+        print(f'\tMean evaluations: {np.mean(evaluations)}')
     print(f'\tFunction in mean result: {function(mean_solution)}')
     print(f'\tMinimums standard deviation: {np.std(mins)}')
 
 
+def rosenbrock_terms(a, b):
+    '''
+    Compute the Rosenbrock terms of the adjacent pairs (a, b)
+    '''
+    return 100 * ((b - a ** 2) ** 2) + (1 - a) ** 2
+
+
+def rosenbrock_state(x):
+    '''
+    Compute the incremental state of the Rosenbrock function (its value)
+    '''
+    x = np.asarray(x)
+    return np.sum(rosenbrock_terms(x[..., :-1], x[..., 1:]), axis=-1)[..., np.newaxis]
+
+
+def rosenbrock_delta(x, state, d, x_d):
+    '''
+    Update the Rosenbrock function when the coordinate d is set to x_d
+    '''
+    y = state[..., 0] + pair_delta(rosenbrock_terms, x, d, x_d)
+    return y, y[..., np.newaxis]
+
+
+@incremental(rosenbrock_state, rosenbrock_delta)
+@batched
 def rosenbrock(x):
     '''
     Compute the generalized Rosenbrock function.
     In 2D, minimum 0 at (1, 1), in range [-30, 30]
     '''
-    y = 0
-    for i in range(len(x) - 1):
-        y += (100 * ((x[i + 1] - x[i] ** 2) ** 2) + (1 - x[i]) ** 2)
-    return y
+    x = np.asarray(x)
+    return np.sum(rosenbrock_terms(x[..., :-1], x[..., 1:]), axis=-1)
 
 
+@batched
 def sixhump(x):
     '''
     Compute the 2D six-hump camelback function.
     Minimum -1.0316 at (0.0898, -0.7126) and (-0.0898, 0.7126).
     X1 in range [-3, 3], X2 in range [-2, 2]
     '''
+    x = np.asarray(x)
+    x1, x2 = x[..., 0], x[..., 1]
     return (
-        (4 - 2.1 * (x[0] ** 2) + (x[0] ** 4) / 3.) *
-        (x[0] ** 2) + x[0] * x[1] + (-4 + 4 * (x[1]**2)) * (x[1] ** 2)
+        (4 - 2.1 * (x1 ** 2) + (x1 ** 4) / 3.) *
+        (x1 ** 2) + x1 * x2 + (-4 + 4 * (x2**2)) * (x2 ** 2)
     )
 
 
+def rastrigin_terms(x):
+    '''
+    Compute the per-coordinate Rastrigin terms
+    '''
+    return (x ** 2) - 10 * np.cos(2 * np.pi * x)
+
+
+def rastrigin_state(x):
+    '''
+    Compute the incremental state of the Rastrigin function (the sum of its terms)
+    '''
+    return np.sum(rastrigin_terms(np.asarray(x)), axis=-1)[..., np.newaxis]
+
+
+def rastrigin_delta(x, state, d, x_d):
+    '''
+    Update the Rastrigin function when the coordinate d is set to x_d
+    '''
+    s = state[..., 0] + rastrigin_terms(x_d) - rastrigin_terms(coordinate(x, d))
+    return (10 * np.shape(x)[-1]) + s, s[..., np.newaxis]
+
+
+@incremental(rastrigin_state, rastrigin_delta)
+@batched
 def rastrigin(x):
     '''
     Compute the Rastrigin function.
     Minimum 0 at (0, ..., 0), in range [-5.12, 5.12]
     '''
-    return (10 * x.size) + np.sum((x ** 2) - 10 * np.cos(2 * np.pi * x))
+    x = np.asarray(x)
+    return (10 * x.shape[-1]) + np.sum(rastrigin_terms(x), axis=-1)
+
+
+def ackley_value(squares, cosines, n_vars):
+    '''
+    Compute the Ackley function from the sums of squares and cosines
+    '''
+    return (
+        (20 - 20 * np.exp(-0.2 * np.sqrt((1 / n_vars) * np.maximum(squares, 0)))
+         + np.exp(1) - np.exp((1 / n_vars) * cosines))
+    )
+
+
+def ackley_state(x):
+    '''
+    Compute the incremental state of the Ackley function (its sums of squares and cosines)
+    '''
+    x = np.asarray(x)
+    return np.stack((np.sum(x ** 2, axis=-1), np.sum(np.cos(2 * np.pi * x), axis=-1)), axis=-1)
+
 
+def ackley_delta(x, state, d, x_d):
+    '''
+    Update the Ackley function when the coordinate d is set to x_d
+    '''
+    old = coordinate(x, d)
+    squares = state[..., 0] + x_d ** 2 - old ** 2
+    cosines = state[..., 1] + np.cos(2 * np.pi * x_d) - np.cos(2 * np.pi * old)
+    return (
+        ackley_value(squares, cosines, np.shape(x)[-1]),
+        np.stack((squares, cosines), axis=-1)
+    )
 
+
+@incremental(ackley_state, ackley_delta)
+@batched
 def ackley(x):
     '''
     Compute the Ackley function.
     Minimum 0 at (0, ..., 0), in range [-32, 32]
     '''
-    return (
-        (20 - 20 * np.exp(-0.2 * np.sqrt((1/x.size) * np.sum(x**2)))
-         + np.exp(1) - np.exp((1 / x.size) * np.sum(np.cos(2 * np.pi * x))))
+    x = np.asarray(x)
+    return ackley_value(
+        np.sum(x**2, axis=-1), np.sum(np.cos(2 * np.pi * x), axis=-1), x.shape[-1]
     )
 
 
+def schaffer_terms(a, b):
+    '''
+    Compute the Schaffer terms of the adjacent pairs (a, b)
+    '''
+    s = (a ** 2) + (b ** 2)
+    return (s ** 0.25) * (((np.sin(50 * s ** 0.10)) ** 2) + 1)
+
+
+def schaffer_state(x):
+    '''
+    Compute the incremental state of the Schaffer function (its value)
+    '''
+    x = np.asarray(x)
+    return np.sum(schaffer_terms(x[..., :-1], x[..., 1:]), axis=-1)[..., np.newaxis]
+
+
+def schaffer_delta(x, state, d, x_d):
+    '''
+    Update the Schaffer function when the coordinate d is set to x_d
+    '''
+    y = state[..., 0] + pair_delta(schaffer_terms, x, d, x_d)
+    return y, y[..., np.newaxis]
+
+
+@incremental(schaffer_state, schaffer_delta)
+@batched
 def schaffer(x):
     '''
     Compute the Schaffer function.
     Minimum 0 at (0, ..., 0), in range [-100, 100]
     '''
-    y = 0
-    for i in range(len(x) - 1):
-        y += (
-            (((x[i] ** 2) + (x[i + 1] ** 2)) ** 0.25) *
-            (((np.sin(50 * ((x[i] ** 2) + (x[i + 1] ** 2)) ** 0.10)) ** 2) + 1)
-        )
-    return y
+    x = np.asarray(x)
+    return np.sum(schaffer_terms(x[..., :-1], x[..., 1:]), axis=-1)
 
 
 FUNCTIONS = {
@@ -104,3 +392,9 @@ FUNCTIONS = {
     'schaffer': schaffer,
     'sixhump': sixhump
 }
+
+# Floating point types of the colonies and simplices
+DTYPES = {
+    'float64': np.float64,
+    'float32': np.float32
+}